@@ -1,11 +1,14 @@
+import asyncio
 import logging
 import logging.config
+import os
 
 # Now import modules that use loggers
 import orders.order_entry_master as order_entry_master
 from database import DatabaseHandler  # New import
 from fastapi import FastAPI, HTTPException, Request  # Import Request here
 from logging_config import setup_logging
+from orders.jobs import JobRegistry
 
 # Setup logging
 setup_logging()
@@ -27,6 +30,10 @@ db_handler = DatabaseHandler()
 
 VALID_ORDER_TYPES = ["grain", "resolute_inbound", "resolute_outbound"]
 
+# Runs of /process_orders, executed off the event loop and kept for polling on /jobs/{job_id}.
+# Job ids are per process: with several uvicorn workers a poll can reach a worker that does not know the job
+jobs = JobRegistry(workers=int(os.getenv('JOB_WORKERS', '2')), max_jobs=int(os.getenv('JOB_HISTORY_SIZE', '100')))
+
 @app.post("/process_orders")
 async def process_orders(request: Request):
     try:
@@ -42,12 +49,14 @@ async def process_orders(request: Request):
                     detail=f"Invalid order_type: '{ot}'. Valid options are: {valid_options}."
                 )
         
-        print("Session created:", db_handler.is_healthy(), "in the env", db_handler.env)
-        
-        # Process orders based on the provided order_type
-        result = await order_entry_master.process_orders(db_handler, order_type)  # Pass the session to process_orders
-        app_logger.info("Process orders endpoint called.")
-        return result
+        # Process orders based on the provided order_type, on the job executor so the server keeps answering
+        job = jobs.submit(order_type, order_entry_master.process_orders, db_handler, order_type)
+        app_logger.info(f"Process orders endpoint called, job {job.id}.")
+
+        # wait=true keeps the previous behavior of answering with the result of the run
+        if request.query_params.get("wait", "false").lower() == "true":
+            return await asyncio.wrap_future(job.future)
+        return {"job_id": job.id, "status": job.status}
     
     except HTTPException as e:
         # If we raised an HTTPException (for bad request)
@@ -59,3 +68,16 @@ async def process_orders(request: Request):
         app_logger.error(f"Exception in process_orders: {e}")
         raise HTTPException(status_code=500, detail=f"Exception: {e}")
 
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: '{job_id}'.")
+    return job.to_dict()
+
+
+@app.get("/health")
+async def health():
+    db_healthy = await asyncio.to_thread(db_handler.is_healthy)
+    return {"status": "ok" if db_healthy else "degraded", "db": db_healthy, "env": db_handler.env}
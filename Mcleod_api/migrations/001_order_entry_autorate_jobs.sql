@@ -0,0 +1,30 @@
+-- Autorate jobs of AutorateQueue (orders/autorate_queue.py). The table name is filled in from
+-- AUTORATE_JOBS_TABLE by tools/apply_migrations.py. Safe to run again: creates the table, or
+-- adds the claim columns to a table created by the previous runtime ensure_table().
+IF OBJECT_ID('VTRPA.DBO.{autorate_jobs_table}', 'U') IS NULL
+CREATE TABLE VTRPA.DBO.{autorate_jobs_table} (
+    lme_order_id VARCHAR(32) NOT NULL PRIMARY KEY,
+    bol VARCHAR(50) NOT NULL,
+    customer_id VARCHAR(20) NULL,
+    status VARCHAR(20) NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    last_error VARCHAR(MAX) NULL,
+    owner VARCHAR(100) NULL,
+    claimed_at DATETIME NULL,
+    created_date DATETIME NOT NULL DEFAULT GETDATE(),
+    last_updated DATETIME NOT NULL DEFAULT GETDATE()
+);
+GO
+
+IF COL_LENGTH('VTRPA.DBO.{autorate_jobs_table}', 'owner') IS NULL
+ALTER TABLE VTRPA.DBO.{autorate_jobs_table} ADD owner VARCHAR(100) NULL;
+GO
+
+IF COL_LENGTH('VTRPA.DBO.{autorate_jobs_table}', 'claimed_at') IS NULL
+ALTER TABLE VTRPA.DBO.{autorate_jobs_table} ADD claimed_at DATETIME NULL;
+GO
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_{autorate_jobs_table}_status'
+               AND object_id = OBJECT_ID('VTRPA.DBO.{autorate_jobs_table}'))
+CREATE INDEX IX_{autorate_jobs_table}_status ON VTRPA.DBO.{autorate_jobs_table} (status, claimed_at);
+GO
@@ -0,0 +1,10 @@
+-- Run locks of RunLock (orders/run_lock.py). The table name is filled in from RUN_LOCK_TABLE
+-- by tools/apply_migrations.py. Safe to run again.
+IF OBJECT_ID('VTRPA.DBO.{run_lock_table}', 'U') IS NULL
+CREATE TABLE VTRPA.DBO.{run_lock_table} (
+    name VARCHAR(50) NOT NULL PRIMARY KEY,
+    owner VARCHAR(100) NULL,
+    acquired_at DATETIME NULL,
+    expires_at DATETIME NULL
+);
+GO
@@ -0,0 +1,197 @@
+# autorate_queue.py
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from orders.lme_api_client import RETRY_POLICIES
+from orders.utils.resilience import CircuitOpenError, backoff_delay
+
+LOGGER = logging.getLogger("orders.autorate_queue")
+
+AutorateJob = namedtuple('AutorateJob', ['lme_order_id', 'bol', 'customer_id'])
+
+
+class AutorateQueue:
+    """
+    Autorates created LME orders on a worker pool, apart from order creation.
+
+    Jobs are persisted in a VTRPA table keyed by LME order id before they are run, so
+    orders created by a run that crashed before autorating are picked up by resume(). The
+    table is created by migrations/001_order_entry_autorate_jobs.sql, applied with
+    python -m tools.apply_migrations.
+
+    A job is claimed by the queue running it (status 'running', owner, claimed_at), so
+    several processes resuming at once never run the same job. Claims older than
+    `claim_timeout` seconds are left by a crashed process and can be taken over.
+
+    The queue owns the retries of the autorate call: the API client is called without its
+    own retries, and the transient errors of RETRY_POLICIES['orders/autorate'] are retried
+    up to `max_attempts` times with jittered backoff. Other errors fail the job at once;
+    when the LME API circuit breaker is open the job stays pending for the next run.
+
+    Args:
+        client (Client): Client whose lme_api_client, record_failure and callbacks are used
+        on_success (callable): Called with the job once the order is autorated
+        table_name (str): Table of the pending jobs in VTRPA.DBO
+        claim_timeout (int): Seconds after which a running job of another process is resumed
+    """
+
+    def __init__(self, client, on_success, table_name, workers=2, max_attempts=5, backoff_base=2.0, claim_timeout=1800):
+        self.client = client
+        self.db = client.db
+        self.on_success = on_success
+        self.table_name = table_name
+        self.claim_timeout = claim_timeout
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='autorate')
+        self._futures = []
+        self._queued = set()
+        # Jobs whose row could not be written, run from memory only
+        self._in_memory = set()
+        self._lock = threading.Lock()
+
+    def resume(self):
+        """Claim and queue the jobs left pending by previous runs, or running in a process that died."""
+        # One UPDATE claims the rows, so a row is only ever claimed by one queue
+        self.db.execute_write_query(
+            f"""
+            UPDATE VTRPA.DBO.{self.table_name}
+            SET status = 'running', owner = :owner, claimed_at = GETDATE(), last_updated = GETDATE()
+            WHERE status = 'pending'
+               OR (status = 'running' AND (claimed_at IS NULL OR claimed_at < DATEADD(second, -:claim_timeout, GETDATE())))
+            """,
+            {'owner': self.owner, 'claim_timeout': self.claim_timeout}
+        )
+        rows = self.db.execute_read_query(
+            f"SELECT lme_order_id, bol, customer_id FROM VTRPA.DBO.{self.table_name} WHERE status = 'running' AND owner = :owner",
+            {'owner': self.owner})
+        if rows:
+            print(f'Resuming {len(rows)} pending autorate jobs')
+            LOGGER.info(f'Resuming {len(rows)} pending autorate jobs')
+        for row in rows:
+            self._submit(AutorateJob(str(row[0]).strip(), row[1].strip(), row[2]))
+
+    def enqueue(self, order_resp):
+        """
+        Persist, claimed by this queue, and queue the autorate of an order created in the LME API.
+
+        When the job cannot be persisted, e.g. the table was not migrated yet, it is still
+        run from memory, so the order gets autorated like before the queue existed; only a
+        crash of the process before it runs loses it.
+        """
+        job = AutorateJob(str(order_resp['id']), order_resp['blnum'], order_resp.get('customer_id'))
+        try:
+            self.db.execute_write_query(
+                f"""
+                IF NOT EXISTS (SELECT 1 FROM VTRPA.DBO.{self.table_name} WHERE lme_order_id = :lme_order_id)
+                INSERT INTO VTRPA.DBO.{self.table_name} (lme_order_id, bol, customer_id, status, owner, claimed_at)
+                VALUES (:lme_order_id, :bol, :customer_id, 'running', :owner, GETDATE())
+                """,
+                dict(job._asdict(), owner=self.owner)
+            )
+        except Exception as e:
+            LOGGER.error(f"Could not persist the autorate job of {job.bol}, running it from memory: {e}")
+            with self._lock:
+                self._in_memory.add(job.lme_order_id)
+        self._submit(job)
+
+    def run_inline(self, order_resp):
+        """Autorate an order on the calling thread, without persisting the job, when it cannot be queued."""
+        job = AutorateJob(str(order_resp['id']), order_resp['blnum'], order_resp.get('customer_id'))
+        with self._lock:
+            self._in_memory.add(job.lme_order_id)
+        self._run(job)
+
+    def _submit(self, job):
+        with self._lock:
+            if job.lme_order_id in self._queued:
+                return
+            self._queued.add(job.lme_order_id)
+            self._futures.append(self._executor.submit(self._run, job))
+
+    def _update_job(self, job, status, attempts, last_error=None):
+        if job.lme_order_id in self._in_memory:
+            return
+        self.db.execute_write_query(
+            f"""
+            UPDATE VTRPA.DBO.{self.table_name}
+            SET status = :status, attempts = attempts + :attempts, last_error = :last_error, last_updated = GETDATE()
+            WHERE lme_order_id = :lme_order_id AND owner = :owner
+            """,
+            {'status': status, 'attempts': attempts, 'last_error': last_error, 'lme_order_id': job.lme_order_id,
+             'owner': self.owner}
+        )
+
+    def _run(self, job):
+        policy = RETRY_POLICIES['orders/autorate']
+        msg_error = None
+        attempts = 0
+        while attempts < self.max_attempts:
+            if attempts:
+                time.sleep(backoff_delay(attempts - 1, self.backoff_base))
+            try:
+                response_autorate = self.client.lme_api_client.autorate(job.lme_order_id, retry=False)
+            except CircuitOpenError as e:
+                msg_error = f"Autorate deferred {job.bol}: {e}"
+                LOGGER.warning(msg_error)
+                if job.lme_order_id in self._in_memory:
+                    # Nothing resumes a job without a row, report the order instead
+                    self.client.record_failure(job.bol, msg_error)
+                self._update_job(job, 'pending', attempts, msg_error)
+                return
+            except Exception as e:
+                attempts += 1
+                msg_error = f"Autorate ERROR {job.bol},api error API connection error: {e}"
+                LOGGER.error(msg_error)
+                if isinstance(e, policy['exceptions']):
+                    continue
+                break
+
+            if response_autorate.status_code != 200:
+                attempts += 1
+                msg_error = f"Autorate ERROR {job.bol},api error {response_autorate.status_code}: {response_autorate.text}')"
+                LOGGER.error(msg_error)
+                if response_autorate.status_code in policy['statuses']:
+                    continue
+                break
+
+            try:
+                self.on_success(job)
+                self._update_job(job, 'done', attempts + 1)
+            except Exception as e:
+                msg_error = f"Error completing autorate of {job.bol}: {e}"
+                LOGGER.error(msg_error)
+                print(msg_error)
+                self.client.record_failure(job.bol, msg_error)
+            return
+
+        print(msg_error)
+        self.client.record_failure(job.bol, msg_error)
+        try:
+            self._update_job(job, 'failed', attempts, msg_error)
+        except Exception as e:
+            LOGGER.error(f"Error updating autorate job of {job.bol}: {e}")
+
+    def join(self):
+        """Wait for every queued job to finish."""
+        while True:
+            with self._lock:
+                futures, self._futures = self._futures, []
+            if not futures:
+                return
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    LOGGER.error(f"Autorate worker error: {e}")
+
+    def shutdown(self):
+        self.join()
+        self._executor.shutdown()
@@ -1,14 +1,26 @@
 import logging
 import os
 import shutil
+import threading
 from abc import ABC, abstractmethod
 from collections import defaultdict
 
 from dotenv import load_dotenv
 
+from orders.jobs import register_client
+from orders.lme_api_client import LmeApiClient
+from orders.run_lock import LeaseLostError, current_lease
+
 LOGGER = logging.getLogger("orders.order_entry_master")
 
 class Client(ABC):
+    # Subclasses set this when iter_orders yields files lazily and post_orders accepts a bols filter
+    supports_streaming = False
+
+    # LME API clients shared by every run of the process, keyed by (api url, user)
+    _lme_api_clients = {}
+    _lme_api_clients_lock = threading.Lock()
+
     def __init__(self, db):
         load_dotenv('config.env')
         self.db = db
@@ -20,9 +32,26 @@ class Client(ABC):
         self.orders_to_post = [] # Orders that will be posted to the API DONE
         self.failed_orders = defaultdict(list) # Orders that failed to be posted to the API or inserted into the VTRPA SQL DB or parsed DONE
         self.posted_orders = [] # Orders that were successfully posted to the API DONE
+        self.deferred_orders = [] # Orders left in downloaded state because the API circuit breaker was open
+        self.orders_parsed = 0 # Orders parsed so far, reported as job progress
+        self._bookkeeping_lock = threading.Lock() # Guards the lists above when orders are posted concurrently
         self.table_order_name = os.getenv('TABLE_ORDERS_PROD') if os.getenv('ENV') == 'production' else os.getenv('TABLE_ORDERS_DEV')
+        # Run each order through the whole pipeline as soon as its file is read, instead of stage by stage
+        self.streaming = self.supports_streaming and os.getenv('ORDERS_STREAMING', 'false').lower() == 'true'
+        # Report progress to the /process_orders job running this client, if any
+        register_client(self)
+        # Run lock of the run creating this client, if any, checked before orders are posted
+        self.run_lease = current_lease.get()
 
     def process_orders(self):
+        if self.streaming:
+            self.process_orders_streaming()
+        else:
+            self.process_orders_batch()
+
+        return self.summarize_run()
+
+    def process_orders_batch(self):
         try:
             self.files_to_process = self.extract_orders()
             print('Files to process len:', len(self.files_to_process))
@@ -33,6 +62,7 @@ class Client(ABC):
         if self.files_to_process:
             try:
                 self.orders_to_insert_into_db = self.parse_data(self.files_to_process)
+                self.orders_parsed = len(self.orders_to_insert_into_db)
                 print('Parsed orders len:', len(self.orders_to_insert_into_db))
             except Exception as e:
                 raise Exception(f"Error parsing orders: {str(e)}")
@@ -56,10 +86,70 @@ class Client(ABC):
                 raise Exception(f"Error updating database: {str(e)}")
 
         try:
+            self.check_run_lease()
             self.post_orders()
         except Exception as e:
             LOGGER.error(f"Error posting orders: {str(e)}")
             raise Exception(f"Error posting orders: {str(e)}")
+
+    def process_orders_streaming(self):
+        """
+        Run every order through parse, validate, post process, update and post as soon as its
+        file is extracted, so the first orders reach the API without waiting for the whole folder.
+        The stage hooks are called with single item lists, and only a reference of each file is kept.
+        """
+        files = self.iter_orders()
+        while True:
+            try:
+                file_to_process = next(files, None)
+            except Exception as e:
+                raise Exception(f"Error extracting orders: {str(e)}")
+            if file_to_process is None:
+                break
+
+            self.files_to_process.append(self.file_reference(file_to_process))
+
+            try:
+                orders = self.parse_data([file_to_process]) or []
+                self.orders_parsed += len(orders)
+            except Exception as e:
+                raise Exception(f"Error parsing orders: {str(e)}")
+            if not orders:
+                continue
+
+            try:
+                orders = self.validate_orders(orders)
+            except Exception as e:
+                raise Exception(f"Error validating orders: {str(e)}")
+
+            try:
+                orders = self.post_process_orders(orders)
+            except Exception as e:
+                raise Exception(f"Error post processing orders: {str(e)}")
+
+            try:
+                self.update_database(orders)
+            except Exception as e:
+                raise Exception(f"Error updating database: {str(e)}")
+
+            try:
+                self.check_run_lease()
+                self.post_orders(bols=[order['bol'] for order in orders])
+            except Exception as e:
+                LOGGER.error(f"Error posting orders: {str(e)}")
+                raise Exception(f"Error posting orders: {str(e)}")
+
+        print('Files to process len:', len(self.files_to_process))
+
+        # Pick up orders left in downloaded state by previous runs
+        try:
+            self.check_run_lease()
+            self.post_orders()
+        except Exception as e:
+            LOGGER.error(f"Error posting orders: {str(e)}")
+            raise Exception(f"Error posting orders: {str(e)}")
+
+    def summarize_run(self):
         #
         # if self.failed_orders:
         #     try:
@@ -75,6 +165,7 @@ class Client(ABC):
             print('Existing orders in API:', len(self.existing_orders_in_api))
             print('Successful API posts:', len(self.posted_orders))
             print('Failed orders:', len(self.failed_orders))
+            print('Deferred orders (LME API unavailable):', len(self.deferred_orders))
             total_orders_in_folder = len(self.existing_orders_in_api) + len(
                 self.posted_orders) + len(self.failed_orders)
 
@@ -110,6 +201,58 @@ class Client(ABC):
         ##Add email message that will fwd errored out orders and their error message to CS team and myself.
         ##Review status description update in order_entry_data table.
 
+    def iter_orders(self):
+        """Yield the files to process one by one. Subclasses can override it to extract lazily."""
+        yield from self.extract_orders()
+
+    def file_reference(self, file_to_process):
+        """What is kept in files_to_process for a streamed file, subclasses can keep less than the whole item."""
+        return file_to_process
+
+    @property
+    def lme_api_client(self):
+        """LME API client with a keep-alive connection pool, shared across runs and Client instances."""
+        key = (self.db.lme_api, self.db.lme_api_user)
+        with Client._lme_api_clients_lock:
+            api_client = Client._lme_api_clients.get(key)
+            if api_client is None:
+                api_client = LmeApiClient(
+                    self.db.lme_api,
+                    self.db.lme_api_user,
+                    self.db.lme_api_pw,
+                    pool_size=int(os.getenv('LME_API_POOL_SIZE', '10')),
+                    connect_timeout=float(os.getenv('LME_API_CONNECT_TIMEOUT', '10')),
+                    read_timeout=float(os.getenv('LME_API_READ_TIMEOUT', '120')),
+                    rate_limit=float(os.getenv('LME_API_RATE_LIMIT', '5')),
+                    burst=int(os.getenv('LME_API_BURST', '10')),
+                    max_retries=int(os.getenv('LME_API_MAX_RETRIES', '3')),
+                    backoff_base=float(os.getenv('LME_API_BACKOFF_BASE', '0.5')),
+                    breaker_threshold=int(os.getenv('LME_API_BREAKER_THRESHOLD', '5')),
+                    breaker_reset_timeout=float(os.getenv('LME_API_BREAKER_RESET', '60')),
+                )
+                Client._lme_api_clients[key] = api_client
+            return api_client
+
+    def check_run_lease(self):
+        """Raise LeaseLostError once the run lock of this run is lost, another process may be posting the same orders."""
+        if self.run_lease is not None and self.run_lease.lost.is_set():
+            raise LeaseLostError(f"Run lock of {self.run_lease.name} lost, stopping before posting orders")
+
+    def record_failure(self, bol, msg_error):
+        """Add an error for a BOL to failed_orders, safe to call from posting worker threads."""
+        with self._bookkeeping_lock:
+            self.failed_orders[bol].append(msg_error)
+
+    def record_posted(self, bol):
+        """Add a BOL to posted_orders, safe to call from posting worker threads."""
+        with self._bookkeeping_lock:
+            self.posted_orders.append(bol)
+
+    def record_deferred(self, bol):
+        """Add a BOL to deferred_orders, safe to call from posting worker threads."""
+        with self._bookkeeping_lock:
+            self.deferred_orders.append(bol)
+
     def move_file(self, file_path, destination_path):
         try:
             if os.path.exists(file_path):
@@ -141,7 +284,7 @@ class Client(ABC):
         pass
 
     @abstractmethod
-    def post_orders(self):
+    def post_orders(self, bols=None):
         pass
 
     @abstractmethod
@@ -4,24 +4,162 @@ import logging
 import os
 import re
 import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pdfplumber
 import requests
 from config import settings
+from orders.autorate_queue import AutorateQueue
 from orders.client import Client
+from orders.location_resolver import get_location_resolver, get_resolution_cache, static_location
+from orders.utils.address_matching import normalize_address
 from orders.order_manager import OrderManager
-from requests.auth import HTTPBasicAuth
+from orders.utils.extraction_manifest import ExtractionManifest
+from orders.utils.resilience import CircuitOpenError
+from orders.utils.sql_batch import chunked, in_clause, rows_per_statement, values_clause
 from utils import pdf_actions
 
-from .grain_vision_fallback import GrainVisionFallback
+from .grain_vision_fallback import forget_partial_ocr_results, get_vision_fallback, vision_fallback_stats
 
 LOGGER = logging.getLogger("orders.grain.grain_order_entry")
 
+# Consignee addresses with a known location code that the location lookup cannot match
+PREDEFINED_ADDRESSES = {
+    'US PL FORT WAYNE FORT WAYNE IN': 'EGIFIN',
+    'CUSTOMER PO: 434759 EAST POINT GA': 'BREEGA',
+    'CUSTOMER PO: 24016434 LAUREL MD': 'NESLMD',
+    '445 HURRICANE TRAIL DACULA GA': 'PUBDGA',
+    '1500 SUCKLE HWY PENNSAUKEN TOWNSHIP NJ': 'BARPNJ'
+}
+# Same overrides, keyed by normalized address so punctuation and suffix spelling do not matter
+PREDEFINED_NORMALIZED_ADDRESSES = {normalize_address(address): code for address, code in PREDEFINED_ADDRESSES.items()}
+
+# Pickup addresses printed on the BOLs that are registered under another address
+PICKUP_ADDRESS_ALIASES = {
+    normalize_address('5101 Sevig Street MUSCATINE IA 52761'): '4815 55TH MUSCATINE IA 52761',
+}
+
+# Pickup addresses with a known location code that the location lookup cannot match
+PREDEFINED_PICKUP_ADDRESSES = {
+    normalize_address('5101 Sevig Street MUSCATINE IA 52761'): 'KENMIA',
+}
+
+# BOLs checked per existence query in validate_orders and post_orders
+VALIDATION_CHUNK_SIZE = 500
+POST_EXISTENCE_CHUNK_SIZE = 500
+
+VALIDATION_INSERT_QUERY = """
+    INSERT INTO VTRPA.DBO.{table} (
+        bol, cons_ref, cust_order_no, collection_method, customer_id,
+        ordered_date, revenue_code, commodity_desc, commodity, ops_user,
+        equipment_type_id, pickup_addr, pickup_loc_code, pickup_state, cons_addr,
+        cons_loc_code, cons_state, pickup_date, consignee_date, order_status,
+        is_processed, doc_to_attach, status_desc, Processed_date, last_updated
+    ) VALUES"""
+
+VALIDATION_INSERT_ROW = """(
+        :bol, :cons_ref, :cust_orderno, :collection_method, :cust_id,
+        :ordered_date, :revenue_code, :commodity_desc, :commodity, :ops_user,
+        :equipment_type_id, :pickup_addr, :pickup_loc_code, :pickup_state, :cons_addr,
+        :cons_loc_code, :cons_state, :pickup_date, :cons_date, :order_status,
+        0, :origin_file, :status_desc, :processed_date, :last_updated
+    )"""
+
+UPDATE_ORDER_QUERY = """
+    UPDATE VTRPA.DBO.{table}
+    SET cons_ref = :cons_ref, cust_order_no = :cust_orderno, collection_method = :collection_method,
+        customer_id = :cust_id, revenue_code = :revenue_code,
+        commodity_desc = :commodity_desc, commodity = :commodity, ops_user = :ops_user,
+        equipment_type_id = :equipment_type_id, pickup_addr = :pickup_addr, pickup_loc_code = :pickup_loc_code,
+        pickup_state = :pickup_state, cons_addr = :cons_addr, cons_loc_code = :cons_loc_code,
+        cons_state = :cons_state, pickup_date = :pickup_date, consignee_date = :cons_date, order_status = :order_status,
+        status_desc = :status_desc, last_updated = :last_updated
+    WHERE bol = :bol
+"""
+
+# Same update as UPDATE_ORDER_QUERY, joined against a VALUES list of rows
+UPDATE_ORDERS_ROW = """(
+        :bol, :cons_ref, :cust_orderno, :collection_method, :cust_id,
+        :revenue_code, :commodity_desc, :commodity, :ops_user, :equipment_type_id,
+        :pickup_addr, :pickup_loc_code, :pickup_state, :cons_addr, :cons_loc_code,
+        :cons_state, :pickup_date, :cons_date, :order_status, :status_desc, :last_updated
+    )"""
+
+UPDATE_ORDERS_BULK_QUERY = """
+    UPDATE t
+    SET cons_ref = s.cons_ref, cust_order_no = s.cust_orderno, collection_method = s.collection_method,
+        customer_id = s.cust_id, revenue_code = s.revenue_code,
+        commodity_desc = s.commodity_desc, commodity = s.commodity, ops_user = s.ops_user,
+        equipment_type_id = s.equipment_type_id, pickup_addr = s.pickup_addr, pickup_loc_code = s.pickup_loc_code,
+        pickup_state = s.pickup_state, cons_addr = s.cons_addr, cons_loc_code = s.cons_loc_code,
+        cons_state = s.cons_state, pickup_date = s.pickup_date, consignee_date = s.cons_date, order_status = s.order_status,
+        status_desc = s.status_desc, last_updated = s.last_updated
+    FROM VTRPA.DBO.{table} AS t
+    JOIN (VALUES {values}) AS s (
+        bol, cons_ref, cust_orderno, collection_method, cust_id,
+        revenue_code, commodity_desc, commodity, ops_user, equipment_type_id,
+        pickup_addr, pickup_loc_code, pickup_state, cons_addr, cons_loc_code,
+        cons_state, pickup_date, cons_date, order_status, status_desc, last_updated
+    ) ON t.bol = s.bol
+"""
+
+
+def extract_pdf_first_page(elem):
+    """
+    Extract the text and table of the first page of a grain PDF.
+
+    Runs in a worker process when parallel extraction is enabled, so it must stay
+    a module level function and only return picklable values.
+
+    Args:
+        elem (str): File name of the PDF inside settings.GRAIN_ORDERS_PATH
+
+    Returns:
+        tuple: ('ok', (text, table, table_master)), ('no_table', None) or ('invalid', error message)
+    """
+    try:
+        with pdfplumber.open(f'{settings.GRAIN_ORDERS_PATH}\\{elem}') as pdf:
+            page = pdf.pages[0]
+            text = page.extract_text()
+            table_master = page.extract_table()
+            if not table_master:
+                return 'no_table', None
+            table1 = str(table_master[0])
+            table = table1.split(r'\n')
+        return 'ok', (text, table, table_master)
+    except Exception as e:
+        if "No /Root object!" in str(e):
+            return 'invalid', str(e)
+        print("Another error:", e)
+        raise
+
+
 class GrainOrderEntry(Client):
+    supports_streaming = True
+
     def __init__(self, db):
         super().__init__(db)
         self.customer_id = 'GRAMIA'
-        self.vision_fallback = GrainVisionFallback() 
+        # Number of worker processes used to read the PDFs, 1 keeps the sequential behavior
+        self.extraction_workers = int(os.getenv('GRAIN_EXTRACTION_WORKERS', '1'))
+        # Orders created in the LME API at the same time, 1 keeps the sequential behavior
+        self.post_workers = int(os.getenv('LME_POST_WORKERS', '1'))
+        self._autorate_queue = None
+        self._autorate_resumed = False
+        self._local_resolutions = None
+        # Extraction and parse results of unchanged PDFs are kept between runs
+        self.extraction_manifest = ExtractionManifest(
+            os.getenv('GRAIN_EXTRACTION_MANIFEST', os.path.join('cache', 'grain_extraction_manifest.json')))
+
+    def process_orders(self):
+        # Documents whose OCR was left incomplete by an engine error in a previous run are escalated again
+        forget_partial_ocr_results()
+        return super().process_orders()
+
+    @property
+    def vision_fallback(self):
+        # Shared by the process and only built once a run needs OCR
+        return get_vision_fallback()
 
     def _try_vision_fallback(self, elem, location_type):
         """
@@ -37,11 +175,8 @@ class GrainOrderEntry(Client):
         try:
             LOGGER.info(f"Attempting Vision API fallback for {elem['bol']} - {location_type}")
             
-            # Get the full path to the PDF file
-            pdf_path = f'{settings.GRAIN_ORDERS_PATH}\\{elem["origin_file"]}'
-            
             # Extract location information using Vision API
-            location_info = self.vision_fallback.extract_location_from_pdf(pdf_path)
+            location_info = self.vision_fallback.extract_location_from_pdf(self._order_pdf_path(elem))
             
             if not location_info or not location_info.get(location_type):
                 LOGGER.error(f"Vision API failed to extract {location_type} location for {elem['bol']}")
@@ -76,19 +211,12 @@ class GrainOrderEntry(Client):
             LOGGER.info(f"Successfully updated {location_type} address using Vision API: {formatted_address}")
             
             # Check if the address is in the predefined addresses
-            predefined_addresses = {
-                'US PL FORT WAYNE FORT WAYNE IN': 'EGIFIN',
-                'CUSTOMER PO: 434759 EAST POINT GA': 'BREEGA',
-                'CUSTOMER PO: 24016434 LAUREL MD': 'NESLMD',
-                '445 HURRICANE TRAIL DACULA GA': 'PUBDGA',
-                '1500 SUCKLE HWY PENNSAUKEN TOWNSHIP NJ': 'BARPNJ'
-            }
-            
-            if formatted_address in predefined_addresses and location_type == 'SO':
-                elem['SO_loc_code'] = predefined_addresses[formatted_address]
+            predefined_code = PREDEFINED_NORMALIZED_ADDRESSES.get(normalize_address(formatted_address))
+            if predefined_code and location_type == 'SO':
+                elem['SO_loc_code'] = predefined_code
                 elem['SO_open'] = '0001'
                 elem['SO_close'] = '2359'
-                LOGGER.info(f"Found predefined location code for {formatted_address}: {predefined_addresses[formatted_address]}")
+                LOGGER.info(f"Found predefined location code for {formatted_address}: {predefined_code}")
                 return True
                 
             return True
@@ -96,124 +224,224 @@ class GrainOrderEntry(Client):
             LOGGER.error(f"Error in Vision API fallback for {elem['bol']} - {location_type}: {e}")
             return False
 
+    def _order_pdf_path(self, elem):
+        """Full path of the PDF the order was read from."""
+        return f'{settings.GRAIN_ORDERS_PATH}\\{elem["origin_file"]}'
+
+    def _prefetch_vision_fallback(self, resolver, orders):
+        """
+        Queue the OCR of the orders whose stops the location index cannot resolve, so the
+        documents are OCRed in batches instead of once per order during the lookups.
+
+        Only the first order of each unresolved stop address is queued: the lookups of the
+        others are answered from the resolution cache once the first one went through the
+        fallback. Addresses already cached, as matches or as misses, are not queued at all.
+        """
+        cache = get_resolution_cache()
+        pdf_paths = []
+        queued_keys = set()
+        for elem in orders:
+            unresolved = []
+            for stop_type in ('PU', 'SO'):
+                key = self._resolution_key(elem, stop_type)
+                # peek, so the prefetch does not count in the cache stats of the lookups
+                if key in queued_keys or cache.peek(key)[0]:
+                    continue
+                matches, location, predefined = self._resolve_locally(resolver, elem, stop_type)
+                if not (matches or location or predefined):
+                    unresolved.append(key)
+            if unresolved:
+                queued_keys.update(unresolved)
+                pdf_paths.append(self._order_pdf_path(elem))
+
+        if pdf_paths:
+            print(f'{len(pdf_paths)} orders need the OCR fallback')
+            self.vision_fallback.prefetch(pdf_paths)
+
     def test_logs(self):
         LOGGER.info('Testing logging from grain_order_entry.')
 
     def extract_orders(self):
-        orders_to_process = []
+        return list(self.iter_orders())
+
+    def iter_orders(self):
         elements = os.listdir(f'{settings.GRAIN_ORDERS_PATH}')
         print('extract_orders len:', len(elements))
-        pdf_elem_count = 0
-        for elem in elements:
-            if elem.lower().endswith('.pdf'):
-                pdf_elem_count+=1
-                
-                try:
-                    print('add order to orders to process elem', elem)
-                    blnum = elem[:-4]  # Assuming elem is a string and you want to get the BOL number.
-                    print('bol number extracted from order:', blnum)
-                    with pdfplumber.open(f'{settings.GRAIN_ORDERS_PATH}\\{elem}') as pdf:
-                        page = pdf.pages[0]
-                        text = page.extract_text()
-                        table_master = page.extract_table()
-                        if not table_master:
-                            print(f'No table found in {elem}')
-                            continue
-                        table1 = str(table_master[0])
-                        table = table1.split(r'\n')
-                    print('extract_orders orders_to_process', len(orders_to_process))
-                    orders_to_process.append((text, table, table_master, elem))
-                    print('extract_orders orders_to_process updated', len(orders_to_process))
-                except Exception as e:
-                    if "No /Root object!" in str(e):
-                        print(f"Invalid PDF file {blnum}: {str(e)}")
-                        LOGGER.error(f"Invalid PDF file {blnum}: {str(e)}")
-                        continue
-                    else:
-                        print("Another error:", e)
-                        raise
+        pdf_elements = [elem for elem in elements if elem.lower().endswith('.pdf')]
+
+        # Reuse the stored extraction of files that did not change since the last run
+        cached = {}
+        pending = []
+        for elem in pdf_elements:
+            entry = self.extraction_manifest.lookup(elem, f'{settings.GRAIN_ORDERS_PATH}\\{elem}')
+            if entry:
+                payload = tuple(entry['payload']) if entry['status'] == 'ok' else entry['payload']
+                cached[elem] = (entry['status'], payload)
+            else:
+                pending.append(elem)
+        print(f'extract_orders manifest hits: {len(cached)}, files to read: {len(pending)}')
+
+        executor = None
+        if self.extraction_workers > 1 and len(pending) > 1:
+            print(f'extract_orders using {self.extraction_workers} worker processes')
+            executor = ProcessPoolExecutor(max_workers=self.extraction_workers)
+            # executor.map yields in submission order, so results stay deterministic
+            extracted = executor.map(extract_pdf_first_page, pending, chunksize=4)
+        else:
+            extracted = map(extract_pdf_first_page, pending)
 
-        print('total pdf', pdf_elem_count)
-        return orders_to_process
+        try:
+            # Yield in folder listing order, pending files are a subsequence of that order
+            for elem in pdf_elements:
+                if elem in cached:
+                    result = cached[elem]
+                else:
+                    result = next(extracted)
+                    self.extraction_manifest.record_extraction(
+                        elem, f'{settings.GRAIN_ORDERS_PATH}\\{elem}', *result)
+
+                order = self._extracted_order(elem, result)
+                if order:
+                    yield order
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+            self.extraction_manifest.prune(pdf_elements)
+            self.extraction_manifest.save()
+
+        print('total pdf', len(pdf_elements))
+
+    def _extracted_order(self, elem, result):
+        """Build the order tuple for `elem`, or log why the file was skipped and return None."""
+        status, payload = result
+        blnum = elem[:-4]  # Assuming elem is a string and you want to get the BOL number.
+        if status == 'invalid':
+            print(f"Invalid PDF file {blnum}: {payload}")
+            LOGGER.error(f"Invalid PDF file {blnum}: {payload}")
+            return None
+        if status == 'no_table':
+            print(f'No table found in {elem}')
+            return None
+
+        text, table, table_master = payload
+        return text, table, table_master, elem
+
+    def file_reference(self, file_to_process):
+        # Only keep the file name of streamed orders, not the extracted text and tables
+        return file_to_process[3]
 
     def validate_orders(self, orders):
+        # Build the rows first, so a malformed order only fails itself
+        rows = []
         for order in orders:
             try:
                 print('elem', order)
                 ordered_date = datetime.datetime.strptime(order['ordered_date'], '%m/%d/%Y').strftime(
                     '%Y%m%d') + '000000-0600'
 
-                # Check if the order exists in the database
-                query = f"SELECT * FROM VTRPA.DBO.{self.table_order_name} WHERE bol = :bol"
-                params = {'bol': order['bol']}
-                existing_order = self.db.execute_read_query(query, params)
+                rows.append((order, {
+                    'bol': order['bol'],
+                    'cons_ref': order['cons_ref'],
+                    'cust_orderno': order['cust_orderno'],
+                    'collection_method': order['collection_method'],
+                    'cust_id': order['cust_id'],
+                    'ordered_date': ordered_date,
+                    'revenue_code': order['revenue_code'],
+                    'commodity_desc': order['commodity_desc'],
+                    'commodity': order['commodity'],
+                    'ops_user': order['ops_user'],
+                    'equipment_type_id': order['equipment_type_id'],
+                    'pickup_addr': '',
+                    'pickup_loc_code': '',
+                    'pickup_state': '',
+                    'cons_addr': '',
+                    'cons_loc_code': '',
+                    'cons_state': '',
+                    'pickup_date': '',
+                    'cons_date': '',
+                    'order_status': 'flag' if order.get('error') else 'parsed',
+                    'origin_file': order['origin_file'],
+                    'status_desc': order.get('error') if order.get('error') else 'Parsed',
+                    'processed_date': datetime.datetime.now(),
+                    'last_updated': datetime.datetime.now(),
+                }))
+            except Exception as e:
+                self._database_write_failed(order, e)
 
-                if not existing_order:
-                    print(f"Insert Into db order: {order}")
-                    query = f"""
-                        INSERT INTO VTRPA.DBO.{self.table_order_name} (
-                            bol, cons_ref, cust_order_no, collection_method, customer_id,
-                            ordered_date, revenue_code, commodity_desc, commodity, ops_user,
-                            equipment_type_id, pickup_addr, pickup_loc_code, pickup_state, cons_addr,
-                            cons_loc_code, cons_state, pickup_date, consignee_date, order_status,
-                            is_processed, doc_to_attach, status_desc, Processed_date, last_updated
-                        ) VALUES (
-                            :bol, :cons_ref, :cust_orderno, :collection_method, :cust_id,
-                            :ordered_date, :revenue_code, :commodity_desc, :commodity, :ops_user,
-                            :equipment_type_id, :pickup_addr, :pickup_loc_code, :pickup_state, :cons_addr,
-                            :cons_loc_code, :cons_state, :pickup_date, :cons_date, :order_status,
-                            0, :origin_file, :status_desc, :processed_date, :last_updated
-                        )
-                    """
-                    params = {
-                        'bol': order['bol'],
-                        'cons_ref': order['cons_ref'],
-                        'cust_orderno': order['cust_orderno'],
-                        'collection_method': order['collection_method'],
-                        'cust_id': order['cust_id'],
-                        'ordered_date': ordered_date,
-                        'revenue_code': order['revenue_code'],
-                        'commodity_desc': order['commodity_desc'],
-                        'commodity': order['commodity'],
-                        'ops_user': order['ops_user'],
-                        'equipment_type_id': order['equipment_type_id'],
-                        'pickup_addr': '',
-                        'pickup_loc_code': '',
-                        'pickup_state': '',
-                        'cons_addr': '',
-                        'cons_loc_code': '',
-                        'cons_state': '',
-                        'pickup_date': '',
-                        'cons_date': '',
-                        'order_status': 'flag' if order.get('error') else 'parsed',
-                        'origin_file': order['origin_file'],
-                        'status_desc': order.get('error') if order.get('error') else 'Parsed',
-                        'processed_date': datetime.datetime.now(),
-                        'last_updated': datetime.datetime.now(),
-                    }
-                else:
+        # Check which orders exist in the database, one query per chunk of BOLs
+        rows_to_insert = []
+        seen_bols = set()
+        for chunk in chunked(rows, VALIDATION_CHUNK_SIZE):
+            try:
+                existing_bols = self._existing_vtrpa_bols([params['bol'] for _, params in chunk])
+            except Exception as e:
+                for order, _ in chunk:
+                    self._database_write_failed(order, e)
+                continue
+
+            for order, params in chunk:
+                # A BOL repeated in the same batch is only inserted once
+                bol = params['bol'].strip()
+                if bol in existing_bols or bol in seen_bols:
                     msg = f'order {order["bol"]} already exist in VTRPA'
                     self.existing_orders_in_vtrpa.append(order['bol'])
                     print(msg)
                     LOGGER.info(f"{msg}")
+                else:
+                    print(f"Insert Into db order: {order}")
+                    rows_to_insert.append((order, params))
+                    seen_bols.add(bol)
 
-                self.db.execute_write_query(query, params)
-                # self.db.commit()
-
+        for chunk in chunked(rows_to_insert, rows_per_statement(VALIDATION_INSERT_ROW)):
+            values, params = values_clause([row_params for _, row_params in chunk], VALIDATION_INSERT_ROW)
+            try:
+                self.db.execute_write_query(f"{VALIDATION_INSERT_QUERY.format(table=self.table_order_name)} {values}", params)
             except Exception as e:
-                msg_error = f"Error adding order to database VTRPA: {str(e)}"
-                # self.failed_orders.append([order['bol'], msg_error])
-                self.failed_orders[order['bol']].append(msg_error)
-                order['error'] = msg_error
-                LOGGER.error(msg_error)
-                # self.db.rollback()  # Rollback for any other unexpected error
+                # Insert the chunk row by row so the failure is attributed to the right BOLs
+                LOGGER.error(f"Bulk insert into VTRPA failed, retrying row by row: {e}")
+                for order, row_params in chunk:
+                    try:
+                        self.db.execute_write_query(
+                            f"{VALIDATION_INSERT_QUERY.format(table=self.table_order_name)} {VALIDATION_INSERT_ROW}",
+                            row_params)
+                    except Exception as row_error:
+                        self._database_write_failed(order, row_error)
 
         return orders
 
+    def _existing_vtrpa_bols(self, bols):
+        """Return the BOLs of `bols` that are already in the VTRPA orders table."""
+        placeholders, params = in_clause(bols, 'bol')
+        query = f"SELECT bol FROM VTRPA.DBO.{self.table_order_name} WHERE bol IN ({placeholders})"
+        # SQL Server ignores trailing spaces when comparing, so strip them here too
+        return {row[0].strip() for row in self.db.execute_read_query(query, params)}
+
+    def _existing_api_bols(self, bols):
+        """Return the BOLs of `bols` that already have an order in the LME orders table."""
+        placeholders, params = in_clause(bols, 'blnum')
+        query = f"SELECT [blnum] FROM [{self.db.database_name}].[dbo].[orders] WHERE [blnum] IN ({placeholders})"
+        # SQL Server ignores trailing spaces when comparing, so strip them here too
+        return {row[0].strip() for row in self.db.execute_read_query(query, params)}
+
+    def _database_write_failed(self, order, e):
+        msg_error = f"Error adding order to database VTRPA: {str(e)}"
+        self.failed_orders[order['bol']].append(msg_error)
+        order['error'] = msg_error
+        LOGGER.error(msg_error)
+
     def parse_data(self, orders_to_process):
         print(f'to process: {orders_to_process}')
         order_list = []
         for text, table, table_master, file_name in orders_to_process:
+            cached_outcome = self.extraction_manifest.get_parse(file_name)
+            if cached_outcome:
+                if cached_outcome['status'] == 'parsed':
+                    order_list.append(cached_outcome['item'])
+                else:
+                    LOGGER.error(cached_outcome['error'])
+                    self.failed_orders[cached_outcome['bol']].append(cached_outcome['error'])
+                continue
+
             try:
                 error = []
                 # Extract various details from the text using regular expressions
@@ -248,8 +476,7 @@ class GrainOrderEntry(Client):
                 pickup = pickup_match.group(1).replace('.', '') if pickup_match else ''
 
                 print('order pickup', pickup)
-                if pickup == '5101 Sevig Street MUSCATINE IA 52761':
-                    pickup = '4815 55TH MUSCATINE IA 52761'
+                pickup = PICKUP_ADDRESS_ALIASES.get(normalize_address(pickup), pickup)
 
                 company_match = re.search(r'SHIP TO (\w+)', table_text_split[1])
                 company = company_match.group(1) if company_match else ''
@@ -285,6 +512,8 @@ class GrainOrderEntry(Client):
                     # self.failed_orders.append([bol, msg_error])
                     error.append(msg_error)
                     self.failed_orders[bol].append(msg_error)
+                    self.extraction_manifest.record_parse(
+                        file_name, {'status': 'skipped', 'bol': bol, 'error': msg_error})
                     print()
 
                     continue
@@ -316,11 +545,24 @@ class GrainOrderEntry(Client):
                 'error': error[0] if len(error) > 0 else None
             }
 
+            self.extraction_manifest.record_parse(file_name, {'status': 'parsed', 'item': item_list})
             order_list.append(item_list)
+
+        # When streaming, iter_orders saves the manifest once the folder is done
+        if not self.streaming:
+            self.extraction_manifest.save()
         return order_list
 
     def post_process_orders(self, orders):
         print("Post-processing orders init..")
+        resolver = get_location_resolver(self.db)
+        # Local resolutions of the stops, shared by the OCR prefetch and the lookups of this pass
+        self._local_resolutions = {}
+        try:
+            self._prefetch_vision_fallback(resolver, orders)
+        except Exception as e:
+            # The fallback OCRs the documents one by one instead
+            LOGGER.error(f"Error queueing the Vision API fallback: {e}")
         try:
             for elem in orders:
                 pu_date = elem['PU_details'][1]
@@ -329,132 +571,31 @@ class GrainOrderEntry(Client):
                 so_dt = datetime.datetime.strptime(so_date.strip(), "%m/%d/%Y")
                 pu_dow = datetime.datetime.date(pu_dt).weekday()
                 so_dow = datetime.datetime.date(so_dt).weekday()
-                week_days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-                pu_dow_open, pu_dow_close = week_days[pu_dow] + '_open', week_days[pu_dow] + '_close'
-                so_dow_open, so_dow_close = week_days[so_dow] + '_open', week_days[so_dow] + '_close'
-
-
-                pu_addr = elem['PU_details'][0].split(' ')
-                so_addr = elem['SO_details'][0].split(' ')
 
-                pu_loc_code_query = f"SELECT [id],[{pu_dow_open}],[{pu_dow_close}] FROM [{self.db.database_name}].[dbo].[location] WHERE is_active = 'Y' and address1 like '%{pu_addr[0]}%' AND state = '{pu_addr[-2]}' AND zip_code='{pu_addr[-1]}' "
-                so_loc_code_query = f"SELECT [id],[{so_dow_open}],[{so_dow_close}] FROM [{self.db.database_name}].[dbo].[location] WHERE is_active = 'Y' and address1 like '%{so_addr[0]}%' AND state = '{so_addr[-1]}' AND city_name like '%{so_addr[-2]}%' AND [address1] like '%{so_addr[1]}%' "
-
-                print(f"pu_loc_code_query: {pu_loc_code_query}")
-                print(f"so_loc_code_query: {so_loc_code_query}")
                 print(f"elements in post process orders {elem}")
 
-                for query in [(pu_loc_code_query, 'PU'), (so_loc_code_query, 'SO')]:
-                    print('query element 1 value is:', query[1])
+                for stop_type, dow in [('PU', pu_dow), ('SO', so_dow)]:
+                    print('query element 1 value is:', stop_type)
 
+                    location = None
                     try:
-                        loc_code = self.db.execute_read_query(query[0])
-
-                        # if len(loc_code) == 0:
-                        #     msg_error = f"Location code not found for {query[1]}: {elem[query[1] + '_details'][0]}"
-                        #     # self.failed_orders.append([elem['bol'], msg_error])
-                        #     self.failed_orders[elem['bol']].append(msg_error)
-                        #     elem['error'] = msg_error
-
-                        #     print(msg_error)
-                        #     LOGGER.error(msg_error)
-                        if len(loc_code) == 0:
-                            # Try fallback with Google Vision API if location code not found
-                            location_found = self._try_vision_fallback(elem, query[1])
-                            if not location_found:
-                                msg_error = f"Location code not found for {query[1]}: {elem[query[1] + '_details'][0]}"
-                                # self.failed_orders.append([elem['bol'], msg_error])
-                                self.failed_orders[elem['bol']].append(msg_error)
-                                elem['error'] = msg_error
-                                print(msg_error)
-                                LOGGER.error(msg_error)
-                            else:
-                                # If we found the location using Vision API, re-run the location query
-                                if query[1] == 'PU':
-                                    pu_addr = elem['PU_details'][0].split(' ')
-                                    fallback_query = f"SELECT [id],[{pu_dow_open}],[{pu_dow_close}] FROM [{self.db.database_name}].[dbo].[location] WHERE is_active = 'Y' and address1 like '%{pu_addr[0]}%' AND state = '{pu_addr[-2]}' AND zip_code='{pu_addr[-1]}' "
-                                    loc_code = self.db.execute_read_query(fallback_query)
-                                else:  # SO
-                                    so_addr = elem['SO_details'][0].split(' ')
-                                    fallback_query = f"SELECT [id],[{so_dow_open}],[{so_dow_close}] FROM [{self.db.database_name}].[dbo].[location] WHERE is_active = 'Y' and address1 like '%{so_addr[0]}%' AND state = '{so_addr[-1]}' AND city_name like '%{so_addr[-2]}%' AND [address1] like '%{so_addr[1]}%' "
-                                    loc_code = self.db.execute_read_query(fallback_query)
-
-                        print('loc_code query:', loc_code)
+                        location = self._resolve_location(resolver, elem, stop_type)
                     except Exception as e:
                         msg_error = f"Error fetching location code: {e}"
                         print(msg_error)
                         LOGGER.error(msg_error)
 
-                    if len(loc_code) == 1:
-                        print('loc code 1')
-                        elem[query[1] + '_loc_code'] = loc_code[0][0].strip()
-                        elem[query[1] + '_open'] = loc_code[0][1].strftime('%H%M') if (
-                                    loc_code[0][1] is not None) else '0000'
-                        elem[query[1] + '_close'] = loc_code[0][2].strftime('%H%M') if (loc_code[0][2] is not None) else '0000'
-
+                    if location:
+                        elem[stop_type + '_loc_code'] = location.id.strip()
+                        elem[stop_type + '_open'], elem[stop_type + '_close'] = location.hours[dow]
                         print(f"elem: {elem}")
-                    elif len(loc_code) > 1:
-                        try:
-                            print('loc code > 1')
-                            additional_query = f"{query[0]} AND [name] LIKE :name"
-                            params = {'name': f"%{elem['so_company']}%"}
-                            loc_code = self.db.execute_read_query(additional_query, params)
-                        except Exception as e:
-                            msg_error = f"Error fetching location code: {e}"
-                            print(msg_error)
-                            LOGGER.error(msg_error)
-
-                        if len(loc_code) == 1:
-                            elem[query[1] + '_loc_code'] = loc_code[0][0].strip()
-                            elem[query[1] + '_open'] = loc_code[0][1].strftime('%H%M')
-                            elem[query[1] + '_close'] = loc_code[0][2].strftime('%H%M')
-                    else:
-                        print('else')
-                        if query[1] == 'SO':
-                            print('else SO')
-                            try:
-                                base_query = query[0][:query[0].rfind('AND')]
-                                loc_code = self.db.execute_read_query(base_query)
-                            except Exception as e:
-                                msg_error = f"Error fetching location code: {e}"
-                                print(msg_error)
-                                LOGGER.error(msg_error)
-                            if len(loc_code) == 1:
-                                elem[query[1] + '_loc_code'] = loc_code[0][0].strip()
-                                elem[query[1] + '_open'] = loc_code[0][1].strftime('%H%M')
-                                elem[query[1] + '_close'] = loc_code[0][2].strftime('%H%M')
-                            elif len(loc_code) > 1:
-                                try:
-                                    additional_query = f"{base_query} AND [name] LIKE :name"
-                                    params = {'name': f"%{elem['so_company']}%"}
-                                    loc_code = self.db.execute_read_query(additional_query, params)
-                                except Exception as e:
-                                    msg_error = f"Error fetching location code: {e}"
-                                    print(msg_error)
-                                    LOGGER.error(msg_error)
-
-                                if len(loc_code) == 1:
-                                    elem[query[1] + '_loc_code'] = loc_code[0][0].strip()
-                                    elem[query[1] + '_open'] = loc_code[0][1].strftime('%H%M')
-                                    elem[query[1] + '_close'] = loc_code[0][2].strftime('%H%M')
-                        else:
-                            if elem['PU_details'][0] == '5101 Sevig Street MUSCATINE IA 52761':
-                                elem[query[1] + '_loc_code'] = 'KENMIA'
-                                elem[query[1] + '_open'] = '0001'
-                                elem[query[1] + '_close'] = '2359'
+
                 if 'SO_loc_code' not in elem.keys():
                     print(f'change SO loc code for {elem["SO_details"][0]}')
 
-                    predefined_addresses = {
-                        'US PL FORT WAYNE FORT WAYNE IN': 'EGIFIN',
-                        'CUSTOMER PO: 434759 EAST POINT GA': 'BREEGA',
-                        'CUSTOMER PO: 24016434 LAUREL MD': 'NESLMD',
-                        '445 HURRICANE TRAIL DACULA GA': 'PUBDGA',
-                        '1500 SUCKLE HWY PENNSAUKEN TOWNSHIP NJ' : 'BARPNJ'
-                    }
-
-                    if elem['SO_details'][0] in predefined_addresses:
-                        elem['SO_loc_code'] = predefined_addresses[elem['SO_details'][0]]
+                    predefined_code = PREDEFINED_NORMALIZED_ADDRESSES.get(normalize_address(elem['SO_details'][0]))
+                    if predefined_code:
+                        elem['SO_loc_code'] = predefined_code
                         elem['SO_open'] = '0001'
                         elem['SO_close'] = '2359'
 
@@ -468,6 +609,10 @@ class GrainOrderEntry(Client):
 
                         print(f"Predefined values assigned for {elem['SO_details'][0]}")
 
+            print('Location resolution cache:', get_resolution_cache().stats())
+            ocr_stats = vision_fallback_stats()
+            if ocr_stats is not None:
+                print('OCR engines:', ocr_stats)
             print('Orders eln after post processing:', len(orders))
             print('Orders after post processing:', orders)
 
@@ -483,8 +628,125 @@ class GrainOrderEntry(Client):
             elem['error'] = msg_error
             LOGGER.error(msg_error)
 
+        self._local_resolutions = None
         return orders
 
+    def _match_location(self, resolver, elem, stop_type, match_second_token=True):
+        if stop_type == 'PU':
+            return resolver.match_pickup(elem['PU_details'][0])
+        return resolver.match_consignee(elem['SO_details'][0], match_second_token=match_second_token)
+
+    def _resolution_key(self, elem, stop_type):
+        """Key of a stop in the resolution cache: database, stop type, normalized address and company."""
+        return (self.db.database_name, stop_type, normalize_address(elem[stop_type + '_details'][0]),
+                normalize_address(elem['so_company']))
+
+    def _resolve_locally(self, resolver, elem, stop_type):
+        """
+        The lookup steps of a stop that need no OCR: the exact match against the location index,
+        the predefined consignee addresses, then the fuzzy match. Results are kept for the
+        current post processing pass, so the OCR prefetch and the lookups run them once.
+
+        Returns:
+            tuple: (exact matches, fuzzy matched LocationRecord or None, True for a predefined consignee address)
+        """
+        key = self._resolution_key(elem, stop_type)
+        if self._local_resolutions is not None and key in self._local_resolutions:
+            return self._local_resolutions[key]
+
+        location = None
+        matches = self._match_location(resolver, elem, stop_type)
+        predefined = not matches and stop_type == 'SO' and key[2] in PREDEFINED_NORMALIZED_ADDRESSES
+        if not matches and not predefined:
+            # Score the address locally before paying for an OCR round trip
+            location = resolver.fuzzy_match(elem[stop_type + '_details'][0], stop_type, elem['so_company'])
+
+        result = (matches, location, predefined)
+        if self._local_resolutions is not None:
+            self._local_resolutions[key] = result
+        return result
+
+    def _resolve_location(self, resolver, elem, stop_type):
+        """
+        Find the location of a stop of the order, going through the shared resolution cache.
+
+        Matches and misses are cached by normalized address, so orders sharing an address
+        do not repeat the lookup or the Vision API fallback. Resolutions that needed the
+        fallback rewrite the address from the document itself, so they are not cached.
+
+        Args:
+            resolver (LocationResolver): Index of the active locations
+            elem (dict): The order element
+            stop_type (str): 'PU' or 'SO'
+
+        Returns:
+            LocationRecord: The location, or None when it could not be resolved to a single one
+        """
+        address = elem[stop_type + '_details'][0]
+        cache = get_resolution_cache()
+        cache_key = self._resolution_key(elem, stop_type)
+
+        cached, result = cache.get(cache_key)
+        if not cached:
+            result = self._lookup_location(resolver, elem, stop_type)
+            if elem[stop_type + '_details'][0] == address:
+                cache.set(cache_key, result, negative=result[0] is None)
+
+        location, msg_error = result
+        if msg_error:
+            self.failed_orders[elem['bol']].append(msg_error)
+            elem['error'] = msg_error
+            print(msg_error)
+            LOGGER.error(msg_error)
+        return location
+
+    def _lookup_location(self, resolver, elem, stop_type):
+        """
+        Match the stop address against the location index. When nothing matches, the address
+        is scored against the index with the fuzzy matcher, then the Vision API fallback is
+        tried. Multiple matches are narrowed down with the consignee company name.
+
+        Returns:
+            tuple: (LocationRecord or None, error message or None)
+        """
+        msg_error = None
+        matches, location, predefined = self._resolve_locally(resolver, elem, stop_type)
+
+        if len(matches) == 0:
+            if predefined:
+                # Assigned from the predefined addresses once the stops are resolved
+                return None, None
+            if location:
+                return location, None
+
+            # Try fallback with Google Vision API if location code not found
+            location_found = self._try_vision_fallback(elem, stop_type)
+            if not location_found:
+                msg_error = f"Location code not found for {stop_type}: {elem[stop_type + '_details'][0]}"
+            else:
+                # If we found the location using Vision API, match again with the new address
+                matches = self._match_location(resolver, elem, stop_type)
+
+        print('loc_code matches:', [match.id for match in matches])
+
+        if len(matches) == 1:
+            return matches[0], msg_error
+        if len(matches) > 1:
+            matches = resolver.filter_by_name(matches, elem['so_company'])
+            return (matches[0] if len(matches) == 1 else None), msg_error
+
+        if stop_type == 'SO':
+            # Retry without the second address token
+            matches = self._match_location(resolver, elem, stop_type, match_second_token=False)
+            if len(matches) > 1:
+                matches = resolver.filter_by_name(matches, elem['so_company'])
+            return (matches[0] if len(matches) == 1 else None), msg_error
+
+        predefined_code = PREDEFINED_PICKUP_ADDRESSES.get(normalize_address(elem['PU_details'][0]))
+        if predefined_code:
+            return static_location(predefined_code), msg_error
+        return None, msg_error
+
     def update_database(self, orders):
         # Add orders to db
         #      [BOL], [cons_ref], [cust_order_no], [collection_method], [customer_id],
@@ -493,6 +755,7 @@ class GrainOrderEntry(Client):
         #       [cons_city], [cons_state], [pickup_date], [consignee_date], [order_status],
         #       [is_processed], [doc_to_attach]
 
+        rows = []
         for order in orders:
             try:
                 print('elem', order)
@@ -510,17 +773,6 @@ class GrainOrderEntry(Client):
                 # if 'SO_close' in order and order['SO_close']:
                 #     so_date += so_date + order['SO_close'] + '00-0600'
 
-                query = f"""
-                    UPDATE VTRPA.DBO.{self.table_order_name}
-                    SET cons_ref = :cons_ref, cust_order_no = :cust_orderno, collection_method = :collection_method,
-                        customer_id = :cust_id, revenue_code = :revenue_code,
-                        commodity_desc = :commodity_desc, commodity = :commodity, ops_user = :ops_user,
-                        equipment_type_id = :equipment_type_id, pickup_addr = :pickup_addr, pickup_loc_code = :pickup_loc_code,
-                        pickup_state = :pickup_state, cons_addr = :cons_addr, cons_loc_code = :cons_loc_code,
-                        cons_state = :cons_state, pickup_date = :pickup_date, consignee_date = :cons_date, order_status = :order_status,
-                        status_desc = :status_desc, last_updated = :last_updated
-                    WHERE bol = :bol
-                """
                 params = {
                     'bol': order['bol'],
                     'cons_ref': order['cons_ref'],
@@ -546,23 +798,71 @@ class GrainOrderEntry(Client):
                 }
 
                 print(f"update database for: {order['bol']}, params: {params}")
+                rows.append((order, params))
 
+            except Exception as e:
+                self._database_write_failed(order, e)
 
-                self.db.execute_write_query(query, params)
-                # self.db.commit()
-
+        # Apply the rows with one set based UPDATE per chunk
+        for chunk in chunked(rows, rows_per_statement(UPDATE_ORDERS_ROW)):
+            values, params = values_clause([row_params for _, row_params in chunk], UPDATE_ORDERS_ROW)
+            try:
+                self.db.execute_write_query(UPDATE_ORDERS_BULK_QUERY.format(table=self.table_order_name, values=values), params)
             except Exception as e:
-                msg_error = f"Error adding order to database VTRPA: {str(e)}"
-                # self.failed_orders.append([order['bol'], msg_error])
-                self.failed_orders[order['bol']].append(msg_error)
-                order['error'] = msg_error
-                LOGGER.error(msg_error)
-                # self.db.rollback()  # Rollback for any other unexpected error
+                # Update the chunk row by row so the failure is attributed to the right BOLs
+                LOGGER.error(f"Bulk update of VTRPA failed, retrying row by row: {e}")
+                for order, row_params in chunk:
+                    try:
+                        self.db.execute_write_query(UPDATE_ORDER_QUERY.format(table=self.table_order_name), row_params)
+                    except Exception as row_error:
+                        self._database_write_failed(order, row_error)
         return
 
-    def post_orders(self):
+    def post_orders(self, bols=None):
+        if bols is not None and not bols:
+            return
+        try:
+            # Orders created by a previous run that never got autorated
+            if not self._autorate_resumed:
+                self._autorate_resumed = True
+                try:
+                    self.autorate_queue.resume()
+                except Exception as e:
+                    LOGGER.error(f"Error resuming pending autorate jobs: {e}")
+
+            self._post_downloaded_orders(bols)
+        finally:
+            # Streaming runs post one order at a time and wait once, on the final unfiltered pass.
+            # The queue is drained even when posting failed, its jobs are orders already created
+            if bols is None and self._autorate_queue is not None:
+                self._autorate_queue.shutdown()
+                self._autorate_queue = None
+
+        print("LME API latency:", self.lme_api_client.latency_stats())
+        print("\nSummary of Order Processing:")
+        print("\nSuccessfully posted orders:")
+        if self.posted_orders:
+            for bol in self.posted_orders:
+                print(bol)
+
+        print("\nOrders with errors:")
+        for failed_order in self.failed_orders:
+            print(f"BOL: {failed_order[0]}, Error: {failed_order[1]}")
+
+    def _post_downloaded_orders(self, bols=None):
+        """Create in the LME API the downloaded orders of the table, only those of `bols` when given."""
         order_manager = OrderManager(self.db, self.table_order_name)
 
+        # When streaming, only the orders that just went through the pipeline are posted
+        bol_filter = ''
+        params = {'customer_id': self.customer_id}
+        if bols is not None:
+            if not bols:
+                return
+            placeholders, bol_params = in_clause(bols, 'bol')
+            bol_filter = f"AND [bol] IN ({placeholders})"
+            params.update(bol_params)
+
         try:
             self.orders_to_post = self.db.execute_read_query(
                 f"""
@@ -570,8 +870,9 @@ class GrainOrderEntry(Client):
                 WHERE [order_status] IN ('downloaded') 
                   AND [is_processed] = 0 
                   AND [customer_id] = :customer_id
+                  {bol_filter}
                 """,
-                {'customer_id': self.customer_id}
+                params
             )
         except Exception as e:
             LOGGER.error(f"Error fetching orders to post: {e}")
@@ -584,189 +885,26 @@ class GrainOrderEntry(Client):
         # error_bols = []
 
         if self.orders_to_post:
-            basic_auth = HTTPBasicAuth(self.db.lme_api_user, self.db.lme_api_pw)
+            # Check which orders already exist in the orders table, one query per chunk of BOLs
+            existing_api_bols = set()
+            for chunk in chunked([elem[0] for elem in self.orders_to_post if elem[0] not in self.failed_orders],
+                                 POST_EXISTENCE_CHUNK_SIZE):
+                existing_api_bols.update(self._existing_api_bols(chunk))
+
+            orders_to_create = []
             for elem in self.orders_to_post:
-                # Check if order with the same bnum already exists in the orders table
                 blnum = elem[0]  # Assuming bnum is the first element in the tuple
 
                 # validate blnum is in the failed orders list, not to post
                 if blnum in self.failed_orders:
                     continue
 
-                exists_query = f"SELECT id FROM [{self.db.database_name}].[dbo].[orders] WHERE [blnum] = :blnum"
-                exists_params = {'blnum': blnum}
-                order_exists = self.db.execute_read_query(exists_query, exists_params)
+                order_exists = blnum.strip() in existing_api_bols
 
                 print('blnum:', blnum, 'order_exists:', order_exists)
                 print('elem:', elem)
 
-                if not order_exists:
-                    order_successful_post = True
-                    order_payload_dict = self.build_order_payload(elem)
-                    put_headers = {
-                        'Accept': 'application/json', 
-                        'Content-Type': 'application/json',
-                        'X-com.mcleodsoftware.CompanyID': 'TMS'
-                    }
-
-                    print('order_payload (raw):', order_payload_dict)
-
-                    try:
-                        created_order = requests.put(self.db.lme_api + '/orders/create', data=order_payload_dict, auth=basic_auth,
-                                                headers=put_headers)
-
-                        # if created_order.status_code != 200:
-                        #     order_successful_post = False
-                        #     LOGGER.error(f'ERROR {elem[0]},api error {created_order.status_code}: {created_order.text}')
-                        #     print(
-                        #         f"created_order - Could not create order {order_payload_dict['blnum']}, api error {created_order.status_code}: {created_order.text}")
-                        #     self.failed_orders.append([order_payload_dict['blnum'],
-                        #                                f"API error {created_order.status_code}: {created_order.text}"])
-                        #     order_manager.update_order_status(order_payload_dict['blnum'], 'flag',
-                        #                                       f"Created Order - API error {created_order.status_code}: {created_order.text}")
-                        #     continue
-                        if created_order.status_code != 200:
-                            try:
-                                print("Api create order error")
-                                error_message = f"API error {created_order.status_code}: {created_order.text}"
-                                LOGGER.error(f"ERROR {elem[0]}, {error_message}")
-
-                                # Ensure order_payload_dict is a dictionary
-                                if isinstance(order_payload_dict, str):
-                                    order_payload_dict = json.loads(order_payload_dict)
-
-                                # Ensure failed_orders[blnum] is a list
-                                self.failed_orders.setdefault(order_payload_dict['blnum'], []).append(error_message)
-
-                                order_manager.update_order_status(order_payload_dict['blnum'], 'flag', error_message)
-                            except Exception as e:
-                                msg_error = f'Error adding error message to failed_orders list: {e}'
-                                LOGGER.error(msg_error)
-                            continue
-
-                    # except Exception as e:
-                    except requests.exceptions.RequestException as e:
-                        print(f"Error creating order via API: {e}")
-                        LOGGER.error(f"Error creating order via API: {e}")
-                        # self.failed_orders.append([elem[0], f"API error: {e}"])
-                        self.failed_orders[elem[0]].append(f"API error: {e}")
-                        order_manager.update_order_status(elem[0], 'flag', f"API error: {e}")
-                        continue
-
-                    try:
-                        order_resp = json.loads(created_order.content)
-                        print(f'order_resp: {order_resp}')
-                    except json.JSONDecodeError:
-                        msg_error = f"Error decoding JSON response from API: {created_order.content}"
-                        print(msg_error)
-                        LOGGER.error(msg_error)
-                        # self.failed_orders.append([elem[0], f"JSONDecodeError: {e}"])
-                        self.failed_orders[elem[0]].append(msg_error)
-
-                        continue
-
-                    for e in [(order_resp['shipper_stop_id'], 'PU', order_resp['blnum']), (order_resp['consignee_stop_id'], 'PO', order_resp['consignee_refno'])]:
-                        try:
-                            query = f"""
-                                INSERT INTO {self.db.database_name}.dbo.reference_number (
-                                    company_id, element_id, partner_id, reference_number, reference_qual, stop_id, id, 
-                                    version, send_to_driver
-                                ) VALUES (
-                                    'TMS', 128, 'TMS', :reference_number, :reference_qual, :stop_id, 
-                                    CONCAT(LOWER(RIGHT(NEWID(), 12)), HOST_NAME()), '004010', 'Y'
-                                )
-                            """
-                            params = {
-                                'reference_number': e[2],
-                                'reference_qual': e[1],
-                                'stop_id': e[0]
-                            }
-
-                            self.db.execute_write_query(query, params)
-
-                        except Exception as e:
-                            msg_error = f"Error inserting reference number into database: {e}"
-                            order_successful_post = False
-                            print(msg_error)
-                            # self.db.rollback()  # Rollback for any other unexpected error
-                            LOGGER.error(msg_error)
-                            # self.failed_orders.append([order_resp['blnum'], msg_error])
-                            self.failed_orders[order_resp['blnum']].append(msg_error)
-                            order_manager.update_order_status(order_resp['blnum'], 'flag', f"Unexpected error: {e}")
-                            break
-
-                    if not order_successful_post:
-                        continue
-
-                    order_manager.update_order_status(order_resp['blnum'], 'created')
-
-                    # Move the file to the imaging folder
-                    # try:
-                    print('move file:', f'{settings.GRAIN_ORDERS_PATH}\\' + elem[21])
-                    Client.move_file(self, f'{settings.GRAIN_ORDERS_PATH}\\' + elem[21],
-                                f'{settings.GRAIN_ORDERS_TO_IMAGING_PATH}')
-                    # except Exception:
-                    #     LOGGER.error(f'move file error: {settings.GRAIN_ORDERS_PATH + elem[21]}')
-                    #     print(f'move file error: {settings.GRAIN_ORDERS_PATH + elem[21]}')
-
-                    try:
-                        response_autorate = requests.post(
-                            f"{self.db.lme_api}/orders/autorate/{order_resp['id']}",
-                            data={'id': order_resp['id']},
-                            auth=basic_auth,
-                            headers=put_headers
-                        )
-                    except Exception as e:
-                        msg_error = f"Autorate ERROR {elem[0]},api error API connection error: {e}"
-                        order_successful_post = False
-                        LOGGER.error(msg_error)
-                        print(msg_error)
-                        # self.failed_orders.append([order_resp['blnum'], msg_error])
-                        self.failed_orders[order_resp['blnum']].append(msg_error)
-                        continue
-
-                    if response_autorate.status_code != 200:
-                        msg_error = f"Autorate ERROR {elem[0]},api error {response_autorate.status_code}: {response_autorate.text}')"
-                        order_successful_post = False
-                        LOGGER.error(msg_error)
-                        print(msg_error)
-                        # self.failed_orders.append([order_resp['blnum'], msg_error])
-                        self.failed_orders[order_resp['blnum']].append(msg_error)
-                        continue
-
-                    print('order_successful_post', order_successful_post)
-
-                    if order_successful_post:
-                        order_manager.update_order_status(order_resp['blnum'], 'autorated')
-                        
-                        try:
-                            update_query = f"""
-                                UPDATE VTRPA.DBO.{self.table_order_name}
-                                SET is_processed = 1
-                                WHERE bol = :bol
-                                AND is_processed = 0
-                            """
-                            params = {'bol': order_resp['blnum']}
-                            self.db.execute_write_query(update_query, params)
-                            print(f"Order {order_resp['blnum']} marked as processed.")
-                            self.posted_orders.append(order_resp['blnum'])
-                        except Exception as e:
-                            msg_error = f"Error updating order status in database: {e}"
-                            LOGGER.error(msg_error)
-                            print(msg_error)
-                            # self.db.rollback()  # Rollback for any other unexpected error
-                            # self.failed_orders.append([order_resp['blnum'], msg_error])
-                            self.failed_orders[order_resp['blnum']].append(msg_error)
-                    else:
-                        print(f"Order {order_resp['blnum']} marked as not processed.")
-
-                    print("Response created_order", created_order.status_code)
-                    print('Response autorate', response_autorate.status_code)
-
-                    attachment_success = self.handle_attachment(order_resp)
-                    if not attachment_success:
-                        print(f"Attachment handling failed for order {order_resp['blnum']}")
-                else:
+                if order_exists:
                     print(f"Order {blnum} already exists in the orders table.")
                     # validate that the blnum is not in the existing_orders_in_api list
                     if blnum not in self.existing_orders_in_api:
@@ -774,6 +912,21 @@ class GrainOrderEntry(Client):
 
                     continue
 
+                orders_to_create.append(elem)
+
+            if self.post_workers > 1 and len(orders_to_create) > 1:
+                # Each order still goes through create, references, file move and autorate in order,
+                # only different orders overlap
+                print(f'posting {len(orders_to_create)} orders with {self.post_workers} workers')
+                with ThreadPoolExecutor(max_workers=self.post_workers) as executor:
+                    futures = [executor.submit(self._create_order, elem, order_manager)
+                               for elem in orders_to_create]
+                    for future in futures:
+                        future.result()
+            else:
+                for elem in orders_to_create:
+                    self._create_order(elem, order_manager)
+
 
                 # if os.path.exists(f'{settings.GRAIN_ORDERS_PATH}\\{elem[21]}'):
                 #     try:
@@ -784,17 +937,173 @@ class GrainOrderEntry(Client):
                 # else:
                 #     print(f"File settings.GRAIN_ORDERS_PATH\\{elem[21]} does not exist.")
 
-        print("\nSummary of Order Processing:")
-        print("\nSuccessfully posted orders:")
-        if self.posted_orders:
-            for bol in self.posted_orders:
-                print(bol)
+    def _create_order(self, elem, order_manager):
+        """
+        Create one downloaded order in the LME API, add its reference numbers, move its file
+        and autorate it. Can run concurrently for different orders, bookkeeping goes through
+        record_failure and record_posted. Raises LeaseLostError once the run lock is lost.
+        """
+        self.check_run_lease()
+        order_successful_post = True
+        order_payload_dict = self.build_order_payload(elem)
 
-        print("\nOrders with errors:")
-        for failed_order in self.failed_orders:
-            print(f"BOL: {failed_order[0]}, Error: {failed_order[1]}")
+        print('order_payload (raw):', order_payload_dict)
 
-        return
+        try:
+            created_order = self.lme_api_client.create_order(order_payload_dict)
+
+            # if created_order.status_code != 200:
+            #     order_successful_post = False
+            #     LOGGER.error(f'ERROR {elem[0]},api error {created_order.status_code}: {created_order.text}')
+            #     print(
+            #         f"created_order - Could not create order {order_payload_dict['blnum']}, api error {created_order.status_code}: {created_order.text}")
+            #     self.failed_orders.append([order_payload_dict['blnum'],
+            #                                f"API error {created_order.status_code}: {created_order.text}"])
+            #     order_manager.update_order_status(order_payload_dict['blnum'], 'flag',
+            #                                       f"Created Order - API error {created_order.status_code}: {created_order.text}")
+            #     continue
+            if created_order.status_code != 200:
+                try:
+                    print("Api create order error")
+                    error_message = f"API error {created_order.status_code}: {created_order.text}"
+                    LOGGER.error(f"ERROR {elem[0]}, {error_message}")
+
+                    # Ensure order_payload_dict is a dictionary
+                    if isinstance(order_payload_dict, str):
+                        order_payload_dict = json.loads(order_payload_dict)
+
+                    self.record_failure(order_payload_dict['blnum'], error_message)
+
+                    order_manager.update_order_status(order_payload_dict['blnum'], 'flag', error_message)
+                except Exception as e:
+                    msg_error = f'Error adding error message to failed_orders list: {e}'
+                    LOGGER.error(msg_error)
+                return
+
+        except CircuitOpenError as e:
+            # The API is down, leave the order downloaded so the next run picks it up
+            print(f"Order {elem[0]} deferred: {e}")
+            LOGGER.warning(f"Order {elem[0]} deferred: {e}")
+            self.record_deferred(elem[0])
+            return
+
+        # except Exception as e:
+        except requests.exceptions.RequestException as e:
+            print(f"Error creating order via API: {e}")
+            LOGGER.error(f"Error creating order via API: {e}")
+            # self.failed_orders.append([elem[0], f"API error: {e}"])
+            self.record_failure(elem[0], f"API error: {e}")
+            order_manager.update_order_status(elem[0], 'flag', f"API error: {e}")
+            return
+
+        try:
+            order_resp = json.loads(created_order.content)
+            print(f'order_resp: {order_resp}')
+        except json.JSONDecodeError:
+            msg_error = f"Error decoding JSON response from API: {created_order.content}"
+            print(msg_error)
+            LOGGER.error(msg_error)
+            # self.failed_orders.append([elem[0], f"JSONDecodeError: {e}"])
+            self.record_failure(elem[0], msg_error)
+
+            return
+
+        for e in [(order_resp['shipper_stop_id'], 'PU', order_resp['blnum']), (order_resp['consignee_stop_id'], 'PO', order_resp['consignee_refno'])]:
+            try:
+                query = f"""
+                    INSERT INTO {self.db.database_name}.dbo.reference_number (
+                        company_id, element_id, partner_id, reference_number, reference_qual, stop_id, id, 
+                        version, send_to_driver
+                    ) VALUES (
+                        'TMS', 128, 'TMS', :reference_number, :reference_qual, :stop_id, 
+                        CONCAT(LOWER(RIGHT(NEWID(), 12)), HOST_NAME()), '004010', 'Y'
+                    )
+                """
+                params = {
+                    'reference_number': e[2],
+                    'reference_qual': e[1],
+                    'stop_id': e[0]
+                }
+
+                self.db.execute_write_query(query, params)
+
+            except Exception as e:
+                msg_error = f"Error inserting reference number into database: {e}"
+                order_successful_post = False
+                print(msg_error)
+                # self.db.rollback()  # Rollback for any other unexpected error
+                LOGGER.error(msg_error)
+                # self.failed_orders.append([order_resp['blnum'], msg_error])
+                self.record_failure(order_resp['blnum'], msg_error)
+                order_manager.update_order_status(order_resp['blnum'], 'flag', f"Unexpected error: {e}")
+                break
+
+        if not order_successful_post:
+            return
+
+        order_manager.update_order_status(order_resp['blnum'], 'created')
+
+        # Move the file to the imaging folder
+        # try:
+        print('move file:', f'{settings.GRAIN_ORDERS_PATH}\\' + elem[21])
+        Client.move_file(self, f'{settings.GRAIN_ORDERS_PATH}\\' + elem[21],
+                    f'{settings.GRAIN_ORDERS_TO_IMAGING_PATH}')
+        # except Exception:
+        #     LOGGER.error(f'move file error: {settings.GRAIN_ORDERS_PATH + elem[21]}')
+        #     print(f'move file error: {settings.GRAIN_ORDERS_PATH + elem[21]}')
+
+        # Autorate runs on its own worker pool, so the next order can be created meanwhile
+        try:
+            self.autorate_queue.enqueue(order_resp)
+        except Exception as e:
+            LOGGER.error(f"Error queueing autorate of {order_resp['blnum']}, autorating it inline: {e}")
+            try:
+                self.autorate_queue.run_inline(order_resp)
+            except Exception as inline_error:
+                msg_error = f"Error autorating {order_resp['blnum']}: {inline_error}"
+                LOGGER.error(msg_error)
+                print(msg_error)
+                self.record_failure(order_resp['blnum'], msg_error)
+
+        print("Response created_order", created_order.status_code)
+
+    @property
+    def autorate_queue(self):
+        if self._autorate_queue is None:
+            self._autorate_queue = AutorateQueue(
+                self,
+                self._autorate_succeeded,
+                table_name=os.getenv('AUTORATE_JOBS_TABLE', 'order_entry_autorate_jobs'),
+                workers=int(os.getenv('AUTORATE_WORKERS', '2')),
+                max_attempts=int(os.getenv('AUTORATE_MAX_ATTEMPTS', '5')),
+                claim_timeout=int(os.getenv('AUTORATE_CLAIM_TIMEOUT', '1800')),
+            )
+        return self._autorate_queue
+
+    def _autorate_succeeded(self, job):
+        """Mark an autorated order as processed and attach its BOL, called from the autorate workers."""
+        OrderManager(self.db, self.table_order_name).update_order_status(job.bol, 'autorated')
+
+        try:
+            update_query = f"""
+                UPDATE VTRPA.DBO.{self.table_order_name}
+                SET is_processed = 1
+                WHERE bol = :bol
+                AND is_processed = 0
+            """
+            params = {'bol': job.bol}
+            self.db.execute_write_query(update_query, params)
+            print(f"Order {job.bol} marked as processed.")
+            self.record_posted(job.bol)
+        except Exception as e:
+            msg_error = f"Error updating order status in database: {e}"
+            LOGGER.error(msg_error)
+            print(msg_error)
+            self.record_failure(job.bol, msg_error)
+
+        attachment_success = self.handle_attachment({'blnum': job.bol, 'customer_id': job.customer_id})
+        if not attachment_success:
+            print(f"Attachment handling failed for order {job.bol}")
 
     def build_order_payload(self, elem):
         print("__type", "stop", "__name", "stops", "company_id", "TMS",
@@ -1,62 +1,321 @@
 # orders/grain/grain_vision_fallback.py
-import io
+import json
 import logging
 import os
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-from google.cloud import vision
-from pdf2image import convert_from_path
+from orders.utils.extraction_manifest import file_sha256
+from orders.utils.ocr_engines import VISION_BATCH_SIZE, build_ocr_engines, detect_with_escalation
+from orders.utils.pdf_render import find_label_region, parse_crop_box, render_page_jpeg, render_settings_from_env
 
 # Get the specific logger for this module
 LOGGER = logging.getLogger("orders.grain.grain_vision_fallback")
 
+# Labels around the stop addresses parsed by _parse_location_info
+LOCATION_START_LABELS = ['PICK UP', 'SHIP TO']
+LOCATION_END_LABELS = ['CARRIER', 'NOTES']
+
+# Fields whose absence escalates a document to the next OCR engine
+KEY_FIELDS = [('PU', 'state'), ('PU', 'zip_code'), ('SO', 'state'), ('SO', 'zip_code')]
+
+# Bounds of the OCR disk cache, 0 disables a bound
+VISION_OCR_CACHE_MAX_AGE_DAYS = float(os.getenv('VISION_OCR_CACHE_MAX_AGE_DAYS', '30'))
+VISION_OCR_CACHE_MAX_FILES = int(os.getenv('VISION_OCR_CACHE_MAX_FILES', '5000'))
+
 class GrainVisionFallback:
-    def __init__(self, temp_dir='temp_images'):
-        """Initialize the Vision API fallback system"""
-        self.client = vision.ImageAnnotatorClient()
-        self.temp_dir = temp_dir
-        # Create temp directory if it doesn't exist
-        os.makedirs(self.temp_dir, exist_ok=True)
-        
+    def __init__(self, cache_dir=None, client=None, engines=None, render_settings=None,
+                 cache_max_age_days=VISION_OCR_CACHE_MAX_AGE_DAYS, cache_max_files=VISION_OCR_CACHE_MAX_FILES):
+        """
+        Initialize the OCR fallback system
+
+        The OCR engines are tried in order, cheapest first (see build_ocr_engines): a
+        document only escalates to the next one, e.g. from the local Tesseract engine to
+        the Google Vision API, while the PU/SO state or zip code are still missing.
+        `client` is passed to the Google Vision engine and can be a local fake of
+        vision.ImageAnnotatorClient.
+
+        The OCR text of every PDF is memoized by content hash, in memory and as a JSON file
+        per document in `cache_dir` (VISION_OCR_CACHE_DIR), so a document is only OCRed once.
+        Cache files not used for `cache_max_age_days` are removed on startup, and the least
+        recently used ones whenever the directory holds more than `cache_max_files`.
+
+        Documents known to need OCR can be queued with prefetch(), which OCRs them in
+        batches of VISION_BATCH_SIZE on a background thread. extract_location_from_pdf waits for the pending
+        batch of its document instead of calling the engines itself.
+
+        Pages are rendered in memory, in grayscale at `render_settings.dpi`, and cropped to
+        the PICK UP / SHIP TO region before being OCRed.
+        """
+        self._engines = engines
+        self._client = client
+        self.cache_dir = cache_dir or os.getenv('VISION_OCR_CACHE_DIR', 'ocr_cache')
+        self.render_settings = render_settings or render_settings_from_env()
+        self.crop_box = parse_crop_box(os.getenv('VISION_CROP_BOX', '0,0,1,0.6'))
+        self._ocr_cache = {}
+        # Texts still missing key fields after an engine other than the last one, kept for the current run only
+        self._partial_texts = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._engines_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='vision-batch')
+        self.cache_max_age_days = cache_max_age_days
+        self.cache_max_files = cache_max_files
+        self._disk_lock = threading.Lock()
+        # Create the cache directory if it doesn't exist
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_entries = 0
+        self._prune_disk_cache(expire=True)
+
     def extract_location_from_pdf(self, pdf_path):
-        """Extract location information from the first page of a PDF using Google Vision API"""
+        """Extract location information from the first page of a PDF with the OCR engines"""
         try:
-            # Convert first page of PDF to image
-            images = convert_from_path(pdf_path, first_page=1, last_page=1)
-            if not images:
-                LOGGER.error(f"Failed to convert PDF to image: {pdf_path}")
-                return None
-                
-            # Save image temporarily
-            img_path = os.path.join(self.temp_dir, f"{os.path.basename(pdf_path)}_page1.jpg")
-            images[0].save(img_path, 'JPEG')
-            
-            # Process the image with Vision API
-            with io.open(img_path, 'rb') as image_file:
-                content = image_file.read()
-            
-            image = vision.Image(content=content)
-            response = self.client.document_text_detection(image=image)
-            
-            if not response.text_annotations:
-                LOGGER.error(f"No text detected in the image: {img_path}")
+            content_hash = file_sha256(pdf_path)
+            self._wait_for_batch(content_hash)
+            document_text = self._cached_text(content_hash)
+            if document_text is None:
+                detected = self._detect_document_text(pdf_path)
+                if detected is None:
+                    return None
+                document_text, persist = detected
+                self._store_text(content_hash, document_text, persist)
+            else:
+                LOGGER.info(f"Using cached OCR text for {pdf_path}")
+
+            if not document_text:
+                LOGGER.error(f"No text detected in the first page of: {pdf_path}")
                 return None
-                
-            # Extract the full text
-            document_text = response.full_text_annotation.text
-            
-            # Clean up temporary file
-            os.remove(img_path)
-            
+
             # Process the extracted text to find location information
             location_info = self._parse_location_info(document_text)
-            
+
             return location_info
-            
+
         except Exception as e:
             LOGGER.error(f"Error extracting location from PDF: {e}")
             return None
-            
+
+    @property
+    def engines(self):
+        """OCR engines, built on first use so runs without fallbacks do not set them up."""
+        with self._engines_lock:
+            if self._engines is None:
+                self._engines = build_ocr_engines(vision_client=self._client)
+            return self._engines
+
+    def forget_partial_results(self):
+        """Drop the incomplete OCR texts of the previous run, so their documents are escalated again."""
+        with self._lock:
+            self._partial_texts.clear()
+
+    def engine_stats(self):
+        """Latency and key field completeness of each OCR engine used so far."""
+        return {engine.name: engine.stats() for engine in self._engines or []}
+
+    def prefetch(self, pdf_paths):
+        """
+        Queue the OCR of documents that are going to need the fallback.
+
+        Documents already cached or queued are skipped; the rest are rasterized and OCRed
+        in batches on a background thread.
+        """
+        to_fetch = []
+        with self._lock:
+            for pdf_path in pdf_paths:
+                try:
+                    content_hash = file_sha256(pdf_path)
+                except Exception as e:
+                    LOGGER.error(f"Error hashing PDF {pdf_path}: {e}")
+                    continue
+                if content_hash in self._pending or self._cached_text(content_hash) is not None:
+                    continue
+                if any(content_hash == queued_hash for queued_hash, _ in to_fetch):
+                    continue
+                to_fetch.append((content_hash, pdf_path))
+
+            for start in range(0, len(to_fetch), VISION_BATCH_SIZE):
+                chunk = to_fetch[start:start + VISION_BATCH_SIZE]
+                future = self._executor.submit(self._annotate_batch, chunk)
+                for content_hash, _ in chunk:
+                    self._pending[content_hash] = future
+
+        if to_fetch:
+            LOGGER.info(f"Queued {len(to_fetch)} documents for batched OCR")
+
+    def _annotate_batch(self, documents):
+        """
+        Rasterize documents and OCR them engine by engine, escalating only the documents
+        still missing key fields. The Google Vision engine sends them with batch_annotate_images.
+        """
+        remaining = []
+        for content_hash, pdf_path in documents:
+            try:
+                content = self._render_first_page(pdf_path)
+            except Exception as e:
+                LOGGER.error(f"Failed to convert PDF to image: {pdf_path}: {e}")
+                continue
+            if content is not None:
+                remaining.append((content_hash, content))
+
+        best = {}
+        for engine in self.engines:
+            if not remaining:
+                break
+            results = engine.detect_batch([content for _, content in remaining])
+            incomplete = []
+            for (content_hash, content), result in zip(remaining, results):
+                if result is None:
+                    incomplete.append((content_hash, content))
+                    continue
+                missing, expected = self._missing_fields(result)
+                engine.record_accuracy(expected - missing, expected)
+                if content_hash not in best or missing < best[content_hash][1]:
+                    best[content_hash] = (result.text, missing, engine)
+                if missing:
+                    incomplete.append((content_hash, content))
+            remaining = incomplete
+
+        for content_hash, (document_text, missing, engine) in best.items():
+            self._store_text(content_hash, document_text, self._is_final(missing, engine))
+
+    def _wait_for_batch(self, content_hash):
+        with self._lock:
+            future = self._pending.get(content_hash)
+        if future is None:
+            return
+        try:
+            future.result()
+        except Exception as e:
+            # The document is OCRed on its own below
+            LOGGER.error(f"Batched OCR failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(content_hash, None)
+
+    def _is_final(self, missing, engine):
+        """Whether an OCR text can be cached on disk: it has every key field, or no engine is left to escalate to."""
+        return missing == 0 or engine is self.engines[-1]
+
+    def _missing_fields(self, result):
+        """(missing, expected) count of the KEY_FIELDS parsed from an OcrResult."""
+        location_info = self._parse_location_info(result.text)
+        missing = sum(not location_info[stop][field] for stop, field in KEY_FIELDS)
+        return missing, len(KEY_FIELDS)
+
+    def _render_first_page(self, pdf_path):
+        """
+        JPEG bytes of the PICK UP / SHIP TO region of the first page, None if it could not be converted.
+
+        The region is found from the word boxes of the PDF text layer; scanned pages without
+        one are cropped to the `crop_box` page fractions instead.
+        """
+        crop_box = None
+        try:
+            crop_box = find_label_region(pdf_path, LOCATION_START_LABELS, LOCATION_END_LABELS)
+        except Exception as e:
+            LOGGER.warning(f"Could not read the text layer of {pdf_path}: {e}")
+        return render_page_jpeg(pdf_path, self.render_settings, crop_box=crop_box or self.crop_box)
+
+    def _detect_document_text(self, pdf_path):
+        """
+        OCR the first page of a PDF.
+
+        Returns:
+            tuple: (detected text, '' when the page has no text, whether it is final), None when it could not be processed
+        """
+        content = self._render_first_page(pdf_path)
+        if content is None:
+            return None
+
+        result, engine = detect_with_escalation(self.engines, content, self._missing_fields)
+        if result is None:
+            return None
+        LOGGER.info(f"OCRed {pdf_path} with {engine.name}")
+        return result.text, self._is_final(self._missing_fields(result)[0], engine)
+
+    def _cache_path(self, content_hash):
+        return os.path.join(self.cache_dir, f'{content_hash}.json')
+
+    def _cached_text(self, content_hash):
+        """OCR text of a document from memory or disk, None if it was never OCRed."""
+        if content_hash in self._ocr_cache:
+            return self._ocr_cache[content_hash]
+        if content_hash in self._partial_texts:
+            return self._partial_texts[content_hash]
+
+        cache_path = self._cache_path(content_hash)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                document_text = json.load(f)['text']
+            # Keep documents still in use from expiring
+            os.utime(cache_path)
+        except Exception as e:
+            LOGGER.error(f"Error reading OCR cache {cache_path}: {e}")
+            return None
+        self._ocr_cache[content_hash] = document_text
+        return document_text
+
+    def _store_text(self, content_hash, document_text, persist=True):
+        if not persist:
+            # Still missing key fields because an engine failed, retried on the next run
+            self._partial_texts[content_hash] = document_text
+            return
+        # Empty results are stored too, a blank page does not get OCRed again
+        self._partial_texts.pop(content_hash, None)
+        self._ocr_cache[content_hash] = document_text
+        cache_path = self._cache_path(content_hash)
+        try:
+            is_new = not os.path.exists(cache_path)
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'text': document_text}, f)
+        except Exception as e:
+            LOGGER.error(f"Error writing OCR cache for {content_hash}: {e}")
+            return
+        if is_new:
+            with self._disk_lock:
+                self._disk_entries += 1
+                over_limit = self.cache_max_files and self._disk_entries > self.cache_max_files
+            if over_limit:
+                self._prune_disk_cache()
+
+    def _prune_disk_cache(self, expire=False):
+        """
+        Remove the expired OCR cache files (with `expire`) and the least recently used ones over `cache_max_files`.
+        """
+        with self._disk_lock:
+            try:
+                entries = []
+                for name in os.listdir(self.cache_dir):
+                    if name.endswith('.json'):
+                        path = os.path.join(self.cache_dir, name)
+                        entries.append((os.path.getmtime(path), path))
+            except OSError as e:
+                LOGGER.error(f"Error listing OCR cache {self.cache_dir}: {e}")
+                return
+
+            entries.sort(reverse=True)
+            to_remove = []
+            if expire and self.cache_max_age_days:
+                cutoff = time.time() - self.cache_max_age_days * 86400
+                to_remove = [path for mtime, path in entries if mtime < cutoff]
+                entries = [(mtime, path) for mtime, path in entries if mtime >= cutoff]
+            if self.cache_max_files and len(entries) > self.cache_max_files:
+                to_remove += [path for _, path in entries[self.cache_max_files:]]
+                entries = entries[:self.cache_max_files]
+
+            for path in to_remove:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    LOGGER.warning(f"Could not remove OCR cache file {path}: {e}")
+            if to_remove:
+                LOGGER.info(f"Pruned {len(to_remove)} OCR cache files from {self.cache_dir}")
+            self._disk_entries = len(entries)
+
     def _parse_location_info(self, text):
         """Parse location information from the extracted text"""
         location_info = {
@@ -121,4 +380,34 @@ class GrainVisionFallback:
                     if zip_match:
                         components['zip_code'] = zip_match.group(1)
         
-        return components
\ No newline at end of file
+        return components
+
+
+_shared_fallback = None
+_shared_fallback_lock = threading.Lock()
+
+
+def get_vision_fallback():
+    """GrainVisionFallback shared by every GrainOrderEntry of the process, with its OCR cache and engines."""
+    global _shared_fallback
+    with _shared_fallback_lock:
+        if _shared_fallback is None:
+            _shared_fallback = GrainVisionFallback()
+        return _shared_fallback
+
+
+def forget_partial_ocr_results():
+    """Start a run without the incomplete OCR texts of the previous one, if the fallback was built."""
+    with _shared_fallback_lock:
+        fallback = _shared_fallback
+    if fallback is not None:
+        fallback.forget_partial_results()
+
+
+def vision_fallback_stats():
+    """OCR engine stats of the shared fallback, or None if no order needed it yet."""
+    with _shared_fallback_lock:
+        fallback = _shared_fallback
+    if fallback is None:
+        return None
+    return fallback.engine_stats()
@@ -0,0 +1,165 @@
+# jobs.py
+import asyncio
+import contextvars
+import datetime
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+LOGGER = logging.getLogger("orders.jobs")
+
+# Job of the run executing in the current context; Client instances register themselves with it
+current_job = contextvars.ContextVar('current_job', default=None)
+
+PROGRESS_COUNTERS = ('files_found', 'parsed', 'posted', 'failed', 'deferred')
+
+
+def register_client(client):
+    """Attach a Client to the job it is created under, if any, so its progress is reported."""
+    job = current_job.get()
+    if job is not None:
+        job.register_client(client)
+
+
+class Job:
+    """
+    One /process_orders run. Progress counters are read live from the lists of the Client
+    instances created by the run, and of the jobs attached to it: the run of each order type
+    reports to its own job, attached to every request waiting on that run, so a request
+    that joined a run in progress also sees its progress.
+    """
+
+    def __init__(self, order_types):
+        self.id = uuid.uuid4().hex
+        self.order_types = order_types
+        self.status = 'pending'
+        self.created_at = datetime.datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.future = None
+        # Order types whose run was already in progress and was joined instead of started
+        self.joined = []
+        self._clients = []
+        self._attached = []
+        self._lock = threading.Lock()
+
+    def register_client(self, client):
+        with self._lock:
+            self._clients.append(client)
+
+    def attach(self, job, joined=False):
+        """Count the clients of `job` in the progress of this one, `joined` when it was started by another request."""
+        with self._lock:
+            self._attached.append(job)
+            if joined:
+                self.joined.extend(job.order_types)
+
+    def clients(self):
+        with self._lock:
+            clients = list(self._clients)
+            attached = list(self._attached)
+        for job in attached:
+            clients.extend(job.clients())
+        return clients
+
+    def progress(self):
+        """files_found, parsed, posted, failed and deferred counts per Client class and in total."""
+        clients = self.clients()
+
+        total = dict.fromkeys(PROGRESS_COUNTERS, 0)
+        by_client = {}
+        for client in clients:
+            counts = {
+                'files_found': len(client.files_to_process),
+                'parsed': client.orders_parsed,
+                'posted': len(client.posted_orders),
+                'failed': len(client.failed_orders),
+                'deferred': len(client.deferred_orders),
+            }
+            client_counts = by_client.setdefault(type(client).__name__, dict.fromkeys(PROGRESS_COUNTERS, 0))
+            for key, count in counts.items():
+                client_counts[key] += count
+                total[key] += count
+        return total, by_client
+
+    def to_dict(self):
+        total, by_client = self.progress()
+        return {
+            'job_id': self.id,
+            'order_types': self.order_types,
+            'status': self.status,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'progress': total,
+            'progress_by_type': by_client,
+            'joined': self.joined,
+            'result': self.result,
+            'error': self.error,
+        }
+
+
+class JobRegistry:
+    """
+    Runs /process_orders jobs on a thread pool and keeps the last `max_jobs` of them for polling.
+    Only finished jobs are evicted, so pending and running jobs can always be polled, even
+    when more than `max_jobs` of them are in flight.
+
+    The registry lives in the memory of the process: with several uvicorn workers, a job id
+    is only known to the worker that created it, and GET /jobs/{job_id} answers 404 when the
+    poll reaches another one. Run a single worker, or route the polls to the same worker.
+
+    Each job runs in a copy of the submitting context with current_job set, so the Client
+    instances it creates, also on the worker threads of the order types, report to it.
+    """
+
+    def __init__(self, workers=2, max_jobs=100):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='orders-job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, order_types, coroutine_function, *args):
+        """
+        Start a job running `coroutine_function(*args)` in its own event loop.
+
+        Returns:
+            Job: The pending job, its future resolves to the result of the run
+        """
+        job = Job(order_types)
+        with self._lock:
+            self._jobs[job.id] = job
+            excess = len(self._jobs) - self.max_jobs
+            if excess > 0:
+                finished = [job_id for job_id, known in self._jobs.items() if known.status in ('done', 'failed')]
+                for job_id in finished[:excess]:
+                    del self._jobs[job_id]
+
+        context = contextvars.copy_context()
+        context.run(current_job.set, job)
+        job.future = self._executor.submit(context.run, self._run, job, coroutine_function, *args)
+        return job
+
+    def _run(self, job, coroutine_function, *args):
+        job.status = 'running'
+        job.started_at = datetime.datetime.now()
+        LOGGER.info(f"Job {job.id} started for {job.order_types}")
+        try:
+            job.result = asyncio.run(coroutine_function(*args))
+            job.status = 'done'
+            return job.result
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'failed'
+            LOGGER.error(f"Job {job.id} failed: {e}")
+            raise
+        finally:
+            job.finished_at = datetime.datetime.now()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
@@ -0,0 +1,152 @@
+# lme_api_client.py
+import logging
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+from orders.utils.resilience import AdaptiveTokenBucket, CircuitBreaker, backoff_delay
+
+LOGGER = logging.getLogger("orders.lme_api_client")
+
+DEFAULT_HEADERS = {
+    'Accept': 'application/json',
+    'Content-Type': 'application/json',
+    'X-com.mcleodsoftware.CompanyID': 'TMS'
+}
+
+# Transient errors retried per endpoint. Creating an order is not idempotent, so it is only
+# retried when the API cannot have processed the request.
+RETRY_POLICIES = {
+    'orders/create': {
+        'statuses': {429, 503},
+        'exceptions': (requests.exceptions.ConnectTimeout,),
+    },
+    'orders/autorate': {
+        'statuses': {429, 500, 502, 503, 504},
+        'exceptions': (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+    },
+}
+NO_RETRY = {'statuses': set(), 'exceptions': ()}
+
+
+class LmeApiClient:
+    """
+    Client for the McLeod LME API.
+
+    Keeps one requests.Session with a keep-alive connection pool, the basic auth and the
+    default headers, applies (connect, read) timeouts to every call and records the
+    latency of each endpoint.
+
+    Calls go through an adaptive token bucket and a circuit breaker. Server errors, 429s
+    and connection errors slow the rate down and count towards opening the breaker;
+    while it is open calls raise CircuitOpenError without reaching the API. Transient
+    errors listed in RETRY_POLICIES are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, base_url, user, password, pool_size=10, connect_timeout=10, read_timeout=120,
+                 rate_limit=5.0, burst=10, max_retries=3, backoff_base=0.5,
+                 breaker_threshold=5, breaker_reset_timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.rate_limiter = AdaptiveTokenBucket(max_rate=rate_limit, capacity=burst)
+        self.breaker = CircuitBreaker('LME API', failure_threshold=breaker_threshold, reset_timeout=breaker_reset_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.auth = HTTPBasicAuth(user, password)
+        self.session.headers.update(DEFAULT_HEADERS)
+        self._stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        self._stats_lock = threading.Lock()
+
+    def request(self, method, endpoint, path, retry=True, **kwargs):
+        """
+        Send a request to the API.
+
+        Args:
+            method (str): HTTP method
+            endpoint (str): Name the latency is recorded under, e.g. 'orders/autorate'
+            path (str): Path appended to the base url
+            retry (bool): Retry with the RETRY_POLICIES of the endpoint, False for callers with their own retries
+
+        Returns:
+            requests.Response: The response, whatever its status code once retries are exhausted
+
+        Raises:
+            requests.exceptions.RequestException: On connection errors and timeouts
+            CircuitOpenError: When the circuit breaker is open
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        policy = RETRY_POLICIES.get(endpoint, NO_RETRY) if retry else NO_RETRY
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            self.rate_limiter.acquire()
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(endpoint, time.perf_counter() - start, True)
+                self._api_unhealthy()
+                if not isinstance(e, policy['exceptions']) or attempt >= self.max_retries:
+                    raise
+                reason = str(e)
+            else:
+                self._record(endpoint, time.perf_counter() - start, response.status_code >= 400)
+                if response.status_code == 429 or response.status_code >= 500:
+                    self._api_unhealthy()
+                else:
+                    self.breaker.record_success()
+                    self.rate_limiter.reward()
+                if response.status_code not in policy['statuses'] or attempt >= self.max_retries:
+                    return response
+                reason = f'status {response.status_code}'
+
+            delay = backoff_delay(attempt, self.backoff_base)
+            LOGGER.warning(f"Retrying {method} {path} in {delay:.2f}s after {reason}")
+            with self._stats_lock:
+                self._stats[endpoint]['retries'] += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def _api_unhealthy(self):
+        self.breaker.record_failure()
+        self.rate_limiter.penalize()
+
+    def create_order(self, order_payload):
+        return self.request('PUT', 'orders/create', '/orders/create', data=order_payload)
+
+    def autorate(self, order_id, retry=True):
+        return self.request('POST', 'orders/autorate', f'/orders/autorate/{order_id}', retry=retry, data={'id': order_id})
+
+    def _record(self, endpoint, seconds, failed):
+        with self._stats_lock:
+            stats = self._stats[endpoint]
+            stats['calls'] += 1
+            stats['errors'] += int(failed)
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def latency_stats(self):
+        """Calls, errors, retries, average and max latency in milliseconds per endpoint."""
+        with self._stats_lock:
+            return {
+                endpoint: {
+                    'calls': stats['calls'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'avg_ms': round(1000 * stats['total_seconds'] / stats['calls'], 1) if stats['calls'] else 0.0,
+                    'max_ms': round(1000 * stats['max_seconds'], 1),
+                }
+                for endpoint, stats in self._stats.items()
+            }
+
+    def close(self):
+        self.session.close()
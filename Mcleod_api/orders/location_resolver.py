@@ -0,0 +1,259 @@
+# location_resolver.py
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from orders.utils.address_matching import AddressIndex
+from orders.utils.ttl_cache import TTLCache
+
+LOGGER = logging.getLogger("orders.location_resolver")
+
+WEEK_DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+LOCATION_COLUMNS = ['id', 'name', 'address1', 'city_name', 'state', 'zip_code'] + [
+    f'{day}_{edge}' for day in WEEK_DAYS for edge in ('open', 'close')]
+
+# hours holds the ('HHMM' open, 'HHMM' close) window per weekday, indexed like datetime.date.weekday()
+LocationRecord = namedtuple('LocationRecord', ['id', 'name', 'address1', 'city_name', 'state', 'zip_code', 'hours'])
+
+
+def _upper(value):
+    return (value or '').strip().upper()
+
+
+def _hhmm(value):
+    """Format an open/close time column as HHMM, '0000' when it is not set."""
+    return value.strftime('%H%M') if value is not None else '0000'
+
+
+class LocationResolver:
+    """
+    In-memory index of the active rows of dbo.location.
+
+    The rows are loaded once and kept warm for `max_age` seconds. Lookups reproduce the
+    LIKE filters post_process_orders used to send to the database, but run against the
+    rows bucketed by state, zip and city. When a lookup misses, the rows of that state
+    are re-read (at most once every `state_refresh_interval` seconds), so locations
+    created after the full load are found without reloading the whole table.
+
+    Addresses the LIKE filters cannot match can be scored with fuzzy_match, which only
+    accepts a candidate above `fuzzy_threshold` that is clearly ahead of the others.
+    """
+
+    def __init__(self, db, max_age=3600, state_refresh_interval=300, fuzzy_threshold=0.8, fuzzy_margin=0.05):
+        self.db = db
+        self.max_age = max_age
+        self.state_refresh_interval = state_refresh_interval
+        self.fuzzy_threshold = fuzzy_threshold
+        self.fuzzy_margin = fuzzy_margin
+        self.locations = {}
+        self.by_state = defaultdict(set)
+        self.by_zip = defaultdict(set)
+        self.by_city = defaultdict(set)
+        self.loaded_at = None
+        self._state_refreshed_at = {}
+        self._address_index = None
+        self._lock = threading.RLock()
+
+    def _read_locations(self, where='', params=None):
+        columns = ', '.join(f'[{column}]' for column in LOCATION_COLUMNS)
+        query = f"SELECT {columns} FROM [{self.db.database_name}].[dbo].[location] WHERE is_active = 'Y' {where}"
+        return [self._to_record(row) for row in self.db.execute_read_query(query, params)]
+
+    @staticmethod
+    def _to_record(row):
+        # Convert the windows once, so picking the ship date's window is a tuple index
+        hours = tuple((_hhmm(row[6 + 2 * day]), _hhmm(row[7 + 2 * day])) for day in range(len(WEEK_DAYS)))
+        return LocationRecord(row[0], row[1], row[2], row[3], row[4], row[5], hours)
+
+    def _add(self, record):
+        # The address index is built on the first fuzzy match, then kept up to date in place
+        if self._address_index is not None:
+            self._address_index.add(record)
+        self.locations[record.id] = record
+        self.by_state[_upper(record.state)].add(record.id)
+        self.by_zip[_upper(record.zip_code)].add(record.id)
+        self.by_city[_upper(record.city_name)].add(record.id)
+
+    def _remove(self, location_id):
+        record = self.locations.pop(location_id, None)
+        if record is None:
+            return
+        if self._address_index is not None:
+            self._address_index.remove(location_id)
+        self.by_state[_upper(record.state)].discard(location_id)
+        self.by_zip[_upper(record.zip_code)].discard(location_id)
+        self.by_city[_upper(record.city_name)].discard(location_id)
+
+    def load(self):
+        """(Re)load every active location."""
+        with self._lock:
+            records = self._read_locations()
+            self._address_index = None
+            self.locations = {}
+            self.by_state = defaultdict(set)
+            self.by_zip = defaultdict(set)
+            self.by_city = defaultdict(set)
+            for record in records:
+                self._add(record)
+            self.loaded_at = time.monotonic()
+            self._state_refreshed_at = {}
+            LOGGER.info(f"Loaded {len(self.locations)} active locations")
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age:
+                self.load()
+
+    def refresh_state(self, state):
+        """
+        Re-read the active locations of one state and merge them into the index.
+
+        Returns:
+            bool: True if the state was refreshed, False if it was refreshed recently
+        """
+        state = _upper(state)
+        with self._lock:
+            refreshed_at = self._state_refreshed_at.get(state)
+            if refreshed_at is not None and time.monotonic() - refreshed_at < self.state_refresh_interval:
+                return False
+
+            records = self._read_locations('AND state = :state', {'state': state})
+            for location_id in list(self.by_state.get(state, ())):
+                self._remove(location_id)
+            for record in records:
+                self._add(record)
+            self._state_refreshed_at[state] = time.monotonic()
+            LOGGER.info(f"Refreshed {len(records)} active locations for state {state}")
+            return True
+
+    def _find(self, state, predicate, zip_code=None):
+        ids = self.by_state.get(state, set())
+        if zip_code is not None:
+            ids = ids & self.by_zip.get(zip_code, set())
+        return sorted((self.locations[location_id] for location_id in ids if predicate(self.locations[location_id])),
+                      key=lambda record: record.id)
+
+    def _find_with_refresh(self, state, predicate, zip_code=None):
+        self.ensure_loaded()
+        with self._lock:
+            matches = self._find(state, predicate, zip_code)
+            if not matches and self.refresh_state(state):
+                matches = self._find(state, predicate, zip_code)
+        return matches
+
+    def match_pickup(self, address):
+        """
+        Locations for a pickup address "<address> <city> <state> <zip>".
+
+        Same filter as: address1 LIKE '%<first token>%' AND state = <state> AND zip_code = <zip>
+        """
+        addr = address.split(' ')
+        first, state, zip_code = _upper(addr[0]), _upper(addr[-2]), _upper(addr[-1])
+        return self._find_with_refresh(
+            state, lambda record: first in _upper(record.address1), zip_code=zip_code)
+
+    def match_consignee(self, address, match_second_token=True):
+        """
+        Locations for a consignee address "<address> <city> <state>".
+
+        Same filter as: address1 LIKE '%<first token>%' AND state = <state>
+        AND city_name LIKE '%<last city token>%' [AND address1 LIKE '%<second token>%']
+        """
+        addr = address.split(' ')
+        first, second, city, state = _upper(addr[0]), _upper(addr[1]), _upper(addr[-2]), _upper(addr[-1])
+
+        def predicate(record):
+            address1 = _upper(record.address1)
+            return (first in address1 and city in _upper(record.city_name)
+                    and (not match_second_token or second in address1))
+
+        return self._find_with_refresh(state, predicate)
+
+    def fuzzy_match(self, address, stop_type, name=None):
+        """
+        Approximate match of a stop address when the LIKE filters found nothing.
+
+        Args:
+            address (str): "<address> <city> <state> <zip>" for 'PU', "<address> <city> <state>" for 'SO'
+            stop_type (str): 'PU' or 'SO'
+            name (str): Company name used to pick between candidates with close scores
+
+        Returns:
+            LocationRecord: The best candidate, or None when no candidate is confident enough
+        """
+        addr = address.split(' ')
+        if stop_type == 'PU':
+            street_and_city, state, zip_code = ' '.join(addr[:-2]), addr[-2], addr[-1]
+        else:
+            street_and_city, state, zip_code = ' '.join(addr[:-1]), addr[-1], None
+
+        self.ensure_loaded()
+        with self._lock:
+            if self._address_index is None:
+                self._address_index = AddressIndex(self.locations.values())
+            candidates = self._address_index.search(street_and_city, state, zip_code)
+
+        if not candidates or candidates[0].score < self.fuzzy_threshold:
+            return None
+
+        best = [candidate.record for candidate in candidates if candidate.score >= candidates[0].score - self.fuzzy_margin]
+        if len(best) > 1 and name:
+            best = self.filter_by_name(best, name)
+        LOGGER.info(f"Fuzzy match for {stop_type} {address}: {[(c.record.id, c.score) for c in candidates]}")
+        return best[0] if len(best) == 1 else None
+
+    @staticmethod
+    def filter_by_name(matches, name):
+        """Narrow matches down with: [name] LIKE '%<name>%'"""
+        name = _upper(name)
+        return [record for record in matches if name in _upper(record.name)]
+
+
+def static_location(location_id, open_time='0001', close_time='2359'):
+    """Record for a location assigned by code, open with the same window every day."""
+    return LocationRecord(location_id, None, None, None, None, None, ((open_time, close_time),) * len(WEEK_DAYS))
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_location_resolver(db):
+    """Resolver shared by every run of the process for the database of `db`."""
+    with _resolvers_lock:
+        resolver = _resolvers.get(db.database_name)
+        if resolver is None:
+            resolver = LocationResolver(
+                db,
+                max_age=int(os.getenv('LOCATION_INDEX_MAX_AGE', '3600')),
+                state_refresh_interval=int(os.getenv('LOCATION_INDEX_STATE_REFRESH', '300')),
+                fuzzy_threshold=float(os.getenv('LOCATION_FUZZY_THRESHOLD', '0.8')),
+            )
+            _resolvers[db.database_name] = resolver
+        else:
+            resolver.db = db
+        return resolver
+
+
+_resolution_cache = None
+
+
+def get_resolution_cache():
+    """
+    Cache of stop resolutions shared by every run of the process.
+
+    Keys are (database, stop type, normalized address, company) and values are (LocationRecord or None,
+    error message or None), so misses are remembered as well as matches.
+    """
+    global _resolution_cache
+    with _resolvers_lock:
+        if _resolution_cache is None:
+            _resolution_cache = TTLCache(
+                max_size=int(os.getenv('LOCATION_CACHE_SIZE', '2048')),
+                ttl=int(os.getenv('LOCATION_CACHE_TTL', '3600')),
+                negative_ttl=int(os.getenv('LOCATION_CACHE_NEGATIVE_TTL', '600')),
+            )
+        return _resolution_cache
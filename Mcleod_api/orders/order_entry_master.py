@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import os
 
 from orders.grain import GrainOrderEntry, process_grain_orders
 from orders.resolute import (
@@ -7,57 +9,115 @@ from orders.resolute import (
     process_resolute_inbound_orders,
     process_resolute_outbound_orders,
 )
+from orders.jobs import Job, current_job
+from orders.run_lock import RunLock, SingleFlight, current_lease
 
 # Get the specific logger for this module
 LOGGER = logging.getLogger("orders.order_entry_master")
 
+# One run per order type in the process, concurrent requests join the one in progress
+single_flight = SingleFlight()
+
+# Coroutine of each order type, in the order their results are reported
+ORDER_TYPE_RUNNERS = {
+    'grain': process_grain_orders,
+    'resolute_inbound': process_resolute_inbound_orders,
+    'resolute_outbound': process_resolute_outbound_orders,
+}
+
+
+def order_type_timeout(order_type):
+    """Seconds an order type may run, from ORDER_TIMEOUT_<TYPE> or ORDER_TIMEOUT; 0 disables it."""
+    timeout = float(os.getenv(f'ORDER_TIMEOUT_{order_type.upper()}', os.getenv('ORDER_TIMEOUT', '3600')))
+    return timeout or None
+
+
+def run_exclusive(db, order_type, run_job=None):
+    """
+    Run an order type while holding its lock row, so the processes of the app never work
+    on the same folder at the same time. Blocks until the run is over.
+
+    The lock is published in current_lease, so the clients of the run stop posting orders
+    once it is lost.
+
+    Args:
+        run_job (Job): Job the clients of the run report their progress to
+
+    Returns:
+        The result of the runner, or ('Skipped', message) when another process holds the lock
+    """
+    runner = ORDER_TYPE_RUNNERS[order_type]
+    if run_job is not None:
+        current_job.set(run_job)
+    if os.getenv('RUN_LOCK_ENABLED', 'true').lower() != 'true':
+        return asyncio.run(runner(db))
+
+    lock = RunLock(db, order_type, table_name=os.getenv('RUN_LOCK_TABLE', 'order_entry_run_locks'),
+                   ttl=int(os.getenv('RUN_LOCK_TTL', '600')))
+    if not lock.acquire():
+        msg = f"{order_type} orders are already being processed by {lock.current_owner()}, skipping this run"
+        LOGGER.warning(msg)
+        print(msg)
+        return ('Skipped', msg)
+    current_lease.set(lock)
+    try:
+        return asyncio.run(runner(db))
+    finally:
+        try:
+            lock.release()
+        except Exception as e:
+            LOGGER.error(f"Error releasing the run lock of {order_type}: {e}")
+
+
+async def run_order_type(db, order_type):
+    """
+    Run one order type on a worker thread with its own event loop, since the runners block
+    while they process. Only one run per order type happens at a time: a request arriving
+    while one is in progress in this process waits for it and gets its result, and its job
+    reports the progress of that run.
+
+    On timeout the thread is not interrupted, the run finishes in the background (still
+    joinable by later requests) but its result is not reported.
+
+    Returns:
+        The result of the runner, or ('Error', message) when it failed or timed out
+    """
+    run_job = Job([order_type])
+    future, joined, run_job = single_flight.run(order_type, run_exclusive, db, order_type, run_job, shared=run_job)
+    job = current_job.get()
+    if job is not None:
+        job.attach(run_job, joined=joined)
+    if joined:
+        print(f'{order_type} orders are already being processed, joining the run in progress')
+        LOGGER.info(f"Joining the {order_type} run in progress")
+    try:
+        # Shielded so a timeout does not cancel the shared run
+        result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), order_type_timeout(order_type))
+        if result is None:
+            raise ValueError("No orders were processed, received None as result.")
+        print(f'{order_type} result', result)
+        return result
+    except asyncio.TimeoutError:
+        msg_error = f"Timed out processing {order_type} orders after {order_type_timeout(order_type)}s"
+    except Exception as e:
+        msg_error = f"Error processing {order_type} orders: {e}"
+    LOGGER.error(msg_error)
+    print(msg_error)
+    return ('Error', msg_error)
+
+
 async def process_orders(db, order_types):
-    results = []
+    """
+    Process the selected order types concurrently. Each type's result, or its error, is
+    collected on its own, so a failing type does not stop the others.
+    """
+    selected = [order_type for order_type in ORDER_TYPE_RUNNERS if order_type in order_types or "all" in order_types]
 
     try:
-        # Check which order types to process
-        if "grain" in order_types or "all" in order_types:
-            try:
-                grain_result = await process_grain_orders(db)
-                print('grain result', grain_result)
-                results.append(grain_result)
-            except Exception as e:
-                msg_error = f"Error processing grain orders: {e}"
-                LOGGER.error(msg_error)
-                print(msg_error)
-                raise ValueError(msg_error)
-
-        if "resolute_inbound" in order_types or "all" in order_types:
-            try:
-                resolute_inbound_result = await process_resolute_inbound_orders(db)
-                if resolute_inbound_result is None:
-                    raise ValueError("No orders were processed for resolute inbound.")
-                results.append(resolute_inbound_result)
-            except Exception as e:
-                msg_error = f"Error processing resolute inbound orders: {e}"
-                LOGGER.error(msg_error)
-                print(msg_error)
-                raise ValueError(msg_error)
-
-        if "resolute_outbound" in order_types or "all" in order_types:
-            try:
-                resolute_outbound_result = await process_resolute_outbound_orders(db)
-                if resolute_outbound_result is None:
-                    raise ValueError("No orders were processed, received None as result.")
-
-                results.append(resolute_outbound_result)
-            except Exception as e:
-                msg_error = f"Error processing resolute outbound orders: {e}"
-                LOGGER.error(msg_error)
-                print(msg_error)
-                raise ValueError(msg_error)
-    
-    except ValueError as e:
-        LOGGER.error(f"Error in processing orders: {e}")
-        results.append(('Error', str(e)))
+        results = list(await asyncio.gather(*(run_order_type(db, order_type) for order_type in selected)))
     except Exception as e:
         LOGGER.error(f"Unexpected error in process_orders: {e}")
-        results.append(('Error', 'An unexpected error occurred during processing'))
+        results = [('Error', 'An unexpected error occurred during processing')]
 
     if len(results) == 0:
         raise ValueError("No orders were processed, received None as result.")
@@ -0,0 +1,183 @@
+# run_lock.py
+import concurrent.futures
+import contextvars
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+LOGGER = logging.getLogger("orders.run_lock")
+
+# Run lock held by the run executing in the current context; Client instances check it before posting
+current_lease = contextvars.ContextVar('current_lease', default=None)
+
+
+class LeaseLostError(Exception):
+    """The run lock expired or was taken over by another process while the run was going on."""
+
+
+class RunLock:
+    """
+    Lock row per order type in a VTRPA table, so only one process of the app runs an
+    order type at a time.
+
+    The lock is taken with a conditional UPDATE of the row (free or expired) and verified by
+    reading the owner back. While held, a heartbeat pushes the expiry forward every
+    ttl / 3 seconds, so the lock of a crashed process frees itself after `ttl` seconds.
+    The table is created by migrations/002_order_entry_run_locks.sql, applied with
+    python -m tools.apply_migrations.
+
+    Each renewal reads the owner back. When another process owns the row, or the renewals
+    failed for so long that the lock may have expired, the `lost` event is set and the run
+    must stop posting orders.
+
+    Args:
+        db (DatabaseHandler): Database of the VTRPA table
+        name (str): What is locked, e.g. the order type
+        table_name (str): Table of the locks in VTRPA.DBO
+        ttl (int): Seconds the lock is kept without a heartbeat
+    """
+
+    def __init__(self, db, name, table_name, ttl=600):
+        self.db = db
+        self.name = name
+        self.table_name = table_name
+        self.ttl = ttl
+        self.owner = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.lost = threading.Event()
+        self._stop_heartbeat = threading.Event()
+        self._heartbeat = None
+
+    def current_owner(self):
+        rows = self.db.execute_read_query(
+            f"SELECT owner FROM VTRPA.DBO.{self.table_name} WHERE name = :name AND expires_at >= GETDATE()",
+            {'name': self.name})
+        return rows[0][0] if rows else None
+
+    def acquire(self):
+        """Take the lock if it is free or expired. Returns True when this instance owns it."""
+        try:
+            self.db.execute_write_query(
+                f"""
+                IF NOT EXISTS (SELECT 1 FROM VTRPA.DBO.{self.table_name} WHERE name = :name)
+                INSERT INTO VTRPA.DBO.{self.table_name} (name) VALUES (:name)
+                """,
+                {'name': self.name})
+        except Exception as e:
+            # Another process inserted the row first
+            LOGGER.warning(f"Lock row of {self.name} already created: {e}")
+
+        self.db.execute_write_query(
+            f"""
+            UPDATE VTRPA.DBO.{self.table_name}
+            SET owner = :owner, acquired_at = GETDATE(), expires_at = DATEADD(second, :ttl, GETDATE())
+            WHERE name = :name AND (owner IS NULL OR expires_at IS NULL OR expires_at < GETDATE())
+            """,
+            {'owner': self.owner, 'ttl': self.ttl, 'name': self.name})
+        if self.current_owner() != self.owner:
+            return False
+
+        self.lost.clear()
+        self._stop_heartbeat.clear()
+        self._heartbeat = threading.Thread(target=self._renew_until_released, name=f'run-lock-{self.name}', daemon=True)
+        self._heartbeat.start()
+        return True
+
+    def _renew_until_released(self):
+        renewed_at = time.monotonic()
+        while not self._stop_heartbeat.wait(self.ttl / 3):
+            try:
+                self.db.execute_write_query(
+                    f"""
+                    UPDATE VTRPA.DBO.{self.table_name}
+                    SET expires_at = DATEADD(second, :ttl, GETDATE())
+                    WHERE name = :name AND owner = :owner
+                    """,
+                    {'ttl': self.ttl, 'name': self.name, 'owner': self.owner})
+                # The UPDATE matches no row once the lock expired and another process took it
+                owner = self.current_owner()
+            except Exception as e:
+                LOGGER.error(f"Error renewing the run lock of {self.name}: {e}")
+                # Keep trying while the next renewal still lands before the lock expires
+                if time.monotonic() - renewed_at + self.ttl / 3 < self.ttl:
+                    continue
+                msg = f"Run lock of {self.name} not renewed for {time.monotonic() - renewed_at:.0f}s, it may have expired"
+            else:
+                if owner == self.owner:
+                    renewed_at = time.monotonic()
+                    continue
+                msg = f"Run lock of {self.name} lost, now held by {owner}"
+            if self._stop_heartbeat.is_set():
+                # release() began during this renewal, the run already finished
+                return
+            LOGGER.error(msg)
+            print(msg)
+            self.lost.set()
+            return
+
+    def release(self):
+        """Stop the heartbeat, waiting for a renewal in flight, then free the lock row."""
+        self._stop_heartbeat.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=60)
+            self._heartbeat = None
+        self.db.execute_write_query(
+            f"""
+            UPDATE VTRPA.DBO.{self.table_name}
+            SET owner = NULL, expires_at = NULL
+            WHERE name = :name AND owner = :owner
+            """,
+            {'name': self.name, 'owner': self.owner})
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key in the process. A call made while another one with the
+    same key is running gets the future of the running one instead of starting again.
+    """
+
+    def __init__(self):
+        self._in_flight = {}
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, *args, shared=None):
+        """
+        Start fn(*args) on its own thread, in a copy of the current context, unless a call
+        with the same key is running.
+
+        Args:
+            shared: Value handed to the calls that join this one, e.g. what reports its progress
+
+        Returns:
+            tuple: (concurrent.futures.Future of the call, True when it joined a running call,
+                the `shared` value of the running call)
+        """
+        with self._lock:
+            if key in self._in_flight:
+                return self._in_flight[key], True, self._shared[key]
+            future = concurrent.futures.Future()
+            self._in_flight[key] = future
+            self._shared[key] = shared
+
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._call, key, future, fn) + args, name=f'single-flight-{key}',
+                         daemon=True).start()
+        return future, False, shared
+
+    def _call(self, key, future, fn, *args):
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self._shared.pop(key, None)
+            future.set_exception(e)
+        else:
+            # Forget the call before publishing its result, so later calls start a new run
+            with self._lock:
+                self._in_flight.pop(key, None)
+                self._shared.pop(key, None)
+            future.set_result(result)
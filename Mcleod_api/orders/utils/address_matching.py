@@ -0,0 +1,175 @@
+# orders/utils/address_matching.py
+import re
+from collections import defaultdict, namedtuple
+
+# USPS style abbreviations, so "STREET" and "ST." compare equal
+STREET_ABBREVIATIONS = {
+    'STREET': 'ST', 'STR': 'ST',
+    'AVENUE': 'AVE', 'AV': 'AVE',
+    'ROAD': 'RD',
+    'DRIVE': 'DR',
+    'HIGHWAY': 'HWY',
+    'BOULEVARD': 'BLVD',
+    'LANE': 'LN',
+    'COURT': 'CT',
+    'PARKWAY': 'PKWY',
+    'PLACE': 'PL',
+    'TRAIL': 'TRL',
+    'CIRCLE': 'CIR',
+    'TERRACE': 'TER',
+    'EXPRESSWAY': 'EXPY',
+    'FREEWAY': 'FWY',
+    'SUITE': 'STE',
+    'BUILDING': 'BLDG',
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+}
+
+# Street types, compared apart from the rest: 100 MAIN ST and 100 MAIN AVE are different streets
+STREET_SUFFIXES = {'ST', 'AVE', 'RD', 'DR', 'HWY', 'BLVD', 'LN', 'CT', 'PKWY', 'PL', 'TRL', 'CIR', 'TER', 'EXPY', 'FWY'}
+
+# Care of lines name a person or company, not the street
+CARE_OF_PATTERN = re.compile(r'\bC\s*/\s*O\b[^\n\d]*', re.IGNORECASE)
+
+AddressCandidate = namedtuple('AddressCandidate', ['record', 'score'])
+
+
+def normalize_address(address):
+    """
+    Normalize an address for comparisons and cache keys.
+
+    Drops care of (C/O) lines, replaces punctuation with spaces, upper cases the text and
+    abbreviates street suffixes and directions.
+
+    Example:
+        normalize_address('5101 Sevig Street,\\nMuscatine IA') -> '5101 SEVIG ST MUSCATINE IA'
+    """
+    address = CARE_OF_PATTERN.sub(' ', address or '')
+    tokens = re.sub(r'[^\w\s:]', ' ', address).upper().split()
+    return ' '.join(STREET_ABBREVIATIONS.get(token, token) for token in tokens)
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a, b):
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def _house_number(tokens):
+    return tokens[0] if tokens and tokens[0].isdigit() else None
+
+
+def _street_suffixes(tokens):
+    return {token for token in tokens if token in STREET_SUFFIXES}
+
+
+def _state(state):
+    return (state or '').strip().upper()
+
+
+class AddressIndex:
+    """
+    Token and trigram index over location records for approximate address matching.
+
+    Each record is indexed by its state and the normalized "<address1> <city_name>" string,
+    so a lookup only reads the locations of one state. Candidates share at least one
+    token (or, failing that, one trigram) with the query and are scored with the Dice
+    coefficient of the trigram sets, with a penalty when both addresses start with
+    different house numbers or have different street types, and a bonus when the zip
+    code matches.
+
+    Records can be added and removed in place, so the index follows the location table
+    without being rebuilt.
+    """
+
+    def __init__(self, records):
+        self.records = {}
+        self._states = {}
+        self._tokens = {}
+        self._trigrams = {}
+        self._house_numbers = {}
+        self._suffixes = {}
+        self.by_token = defaultdict(set)
+        self.by_trigram = defaultdict(set)
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Index a record, replacing the previous version of the same location id."""
+        if record.id in self.records:
+            self.remove(record.id)
+        key = normalize_address(f'{record.address1 or ""} {record.city_name or ""}')
+        tokens = key.split()
+        record_trigrams = trigrams(key)
+        state = _state(record.state)
+        self.records[record.id] = record
+        self._states[record.id] = state
+        self._tokens[record.id] = tokens
+        self._trigrams[record.id] = record_trigrams
+        self._house_numbers[record.id] = _house_number(tokens)
+        self._suffixes[record.id] = _street_suffixes(tokens)
+        for token in tokens:
+            self.by_token[(state, token)].add(record.id)
+        for trigram in record_trigrams:
+            self.by_trigram[(state, trigram)].add(record.id)
+
+    def remove(self, location_id):
+        """Drop a record from the index, if it is indexed."""
+        if self.records.pop(location_id, None) is None:
+            return
+        state = self._states.pop(location_id)
+        self._house_numbers.pop(location_id, None)
+        self._suffixes.pop(location_id, None)
+        for index, keys in ((self.by_token, self._tokens.pop(location_id, ())),
+                            (self.by_trigram, self._trigrams.pop(location_id, ()))):
+            for key in keys:
+                key = (state, key)
+                ids = index.get(key)
+                if ids is None:
+                    continue
+                ids.discard(location_id)
+                if not ids:
+                    del index[key]
+
+    def search(self, street_and_city, state, zip_code=None, limit=5):
+        """
+        Score the locations of `state` against an address without its state and zip.
+
+        Returns:
+            list: AddressCandidate tuples, best score first
+        """
+        query = normalize_address(street_and_city)
+        tokens = query.split()
+        query_trigrams = trigrams(query)
+        house_number = _house_number(tokens)
+        suffixes = _street_suffixes(tokens)
+        state = _state(state)
+
+        ids = set()
+        for token in tokens:
+            ids |= self.by_token.get((state, token), set())
+        if not ids:
+            for trigram in query_trigrams:
+                ids |= self.by_trigram.get((state, trigram), set())
+
+        candidates = []
+        for location_id in ids:
+            record = self.records[location_id]
+            score = _dice(query_trigrams, self._trigrams[location_id])
+            record_house_number = self._house_numbers[location_id]
+            if house_number and record_house_number and house_number != record_house_number:
+                score *= 0.5
+            record_suffixes = self._suffixes[location_id]
+            if suffixes and record_suffixes and not suffixes & record_suffixes:
+                score *= 0.5
+            if zip_code and (record.zip_code or '').strip() == zip_code:
+                score = min(1.0, score + 0.1)
+            candidates.append(AddressCandidate(record, round(score, 4)))
+
+        candidates.sort(key=lambda candidate: (-candidate.score, candidate.record.id))
+        return candidates[:limit]
@@ -0,0 +1,126 @@
+# orders/utils/extraction_manifest.py
+import copy
+import hashlib
+import json
+import logging
+import os
+
+LOGGER = logging.getLogger("orders.utils.extraction_manifest")
+
+# Bump when the stored extraction/parse format changes so old manifests are discarded
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path, chunk_size=1024 * 1024):
+    """Return the hex sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ExtractionManifest:
+    """
+    On-disk record of the PDFs already read from an orders folder.
+
+    Each entry is keyed by file name and stores the file size, mtime and content hash,
+    the extraction outcome ('ok', 'no_table' or 'invalid') with its payload, and the
+    parse outcome once parse_data has run on it. A file is considered unchanged when
+    size and mtime match, or when only the mtime changed but the content hash matches.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = self._load()
+        self._dirty = False
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != MANIFEST_VERSION:
+                LOGGER.info(f"Discarding extraction manifest {self.path} with version {data.get('version')}")
+                return {}
+            return data.get('entries', {})
+        except Exception as e:
+            LOGGER.error(f"Error loading extraction manifest {self.path}: {e}")
+            return {}
+
+    def lookup(self, name, file_path):
+        """
+        Get the manifest entry of a file if the file did not change since it was recorded.
+
+        Returns:
+            dict: The entry, or None when the file is new or changed
+        """
+        entry = self.entries.get(name)
+        if not entry:
+            return None
+
+        stat = os.stat(file_path)
+        if entry['size'] != stat.st_size:
+            return None
+        if entry['mtime'] == stat.st_mtime:
+            return entry
+
+        # Same size but touched, only trust the entry when the content is the same
+        if file_sha256(file_path) != entry['sha256']:
+            return None
+        entry['mtime'] = stat.st_mtime
+        self._dirty = True
+        return entry
+
+    def record_extraction(self, name, file_path, status, payload):
+        """Store the extraction outcome of a file, dropping any previous parse outcome."""
+        stat = os.stat(file_path)
+        self.entries[name] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha256': file_sha256(file_path),
+            'status': status,
+            'payload': payload,
+            'parse': None,
+        }
+        self._dirty = True
+
+    def get_parse(self, name):
+        """Return a copy of the stored parse outcome of a file, or None if it was never parsed."""
+        entry = self.entries.get(name)
+        if not entry or entry.get('parse') is None:
+            return None
+        return copy.deepcopy(entry['parse'])
+
+    def record_parse(self, name, outcome):
+        """Store the parse outcome of a file already present in the manifest."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return
+        # Copy so later pipeline stages mutating the order do not leak into the manifest
+        entry['parse'] = copy.deepcopy(outcome)
+        self._dirty = True
+
+    def prune(self, names):
+        """Forget files that are no longer in the folder."""
+        names = set(names)
+        for name in [name for name in self.entries if name not in names]:
+            del self.entries[name]
+            self._dirty = True
+
+    def save(self):
+        """Write the manifest to disk if it changed, replacing the old file atomically."""
+        if not self._dirty:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, f)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            LOGGER.error(f"Error saving extraction manifest {self.path}: {e}")
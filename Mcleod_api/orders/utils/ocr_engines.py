@@ -0,0 +1,299 @@
+# orders/utils/ocr_engines.py
+import io
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:
+    pytesseract = None
+
+LOGGER = logging.getLogger("orders.utils.ocr_engines")
+
+# Annotations mirror the fields of the Vision API text_annotations that callers read:
+# the first one holds the full text, the following ones a word each.
+Vertex = namedtuple('Vertex', ['x', 'y'])
+BoundingPoly = namedtuple('BoundingPoly', ['vertices'])
+TextAnnotation = namedtuple('TextAnnotation', ['description', 'bounding_poly'])
+OcrResult = namedtuple('OcrResult', ['text', 'annotations'])
+
+# Images per batch_annotate_images call, the synchronous API accepts up to 16
+VISION_BATCH_SIZE = 16
+
+_vision_client = None
+_vision_client_lock = threading.Lock()
+
+
+def box_annotation(description, left, top, right, bottom):
+    vertices = [Vertex(left, top), Vertex(right, top), Vertex(right, bottom), Vertex(left, bottom)]
+    return TextAnnotation(description, BoundingPoly(vertices))
+
+
+class OcrEngine(ABC):
+    """
+    Text detection backend.
+
+    Records the latency of every call and, through record_accuracy, how many of the
+    key fields the callers expected were found in its text.
+    """
+
+    name = None
+
+    def __init__(self):
+        self._stats = {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0,
+                       'fields_found': 0, 'fields_expected': 0}
+        self._stats_lock = threading.Lock()
+
+    @abstractmethod
+    def _detect(self, content):
+        """OcrResult of one encoded image."""
+        pass
+
+    def detect(self, content):
+        """
+        Detect the text of an image.
+
+        Args:
+            content (bytes): Encoded image, e.g. JPEG
+
+        Returns:
+            OcrResult: The text and its annotations
+        """
+        start = time.perf_counter()
+        try:
+            result = self._detect(content)
+        except Exception:
+            self._record(time.perf_counter() - start, 1, True)
+            raise
+        self._record(time.perf_counter() - start, 1, False)
+        return result
+
+    def detect_batch(self, contents):
+        """OcrResult of each image, None for the images that failed."""
+        results = []
+        for content in contents:
+            try:
+                results.append(self.detect(content))
+            except Exception as e:
+                LOGGER.error(f"{self.name} OCR error: {e}")
+                results.append(None)
+        return results
+
+    def _record(self, seconds, calls, failed):
+        with self._stats_lock:
+            self._stats['calls'] += calls
+            self._stats['errors'] += int(failed)
+            self._stats['total_seconds'] += seconds
+            self._stats['max_seconds'] = max(self._stats['max_seconds'], seconds / calls)
+
+    def record_accuracy(self, found, expected):
+        with self._stats_lock:
+            self._stats['fields_found'] += found
+            self._stats['fields_expected'] += expected
+
+    def stats(self):
+        """Calls, errors, average and max latency in milliseconds, and key field completeness."""
+        with self._stats_lock:
+            stats = self._stats
+            return {
+                'calls': stats['calls'],
+                'errors': stats['errors'],
+                'avg_ms': round(1000 * stats['total_seconds'] / stats['calls'], 1) if stats['calls'] else 0.0,
+                'max_ms': round(1000 * stats['max_seconds'], 1),
+                'completeness': round(stats['fields_found'] / stats['fields_expected'], 3) if stats['fields_expected'] else None,
+            }
+
+
+class TesseractEngine(OcrEngine):
+    """Local OCR with Tesseract, needs the pytesseract package and the tesseract binary."""
+
+    name = 'tesseract'
+
+    def __init__(self, lang='eng', config=''):
+        super().__init__()
+        self.lang = lang
+        self.config = config
+
+    @staticmethod
+    def available():
+        if pytesseract is None:
+            return False
+        try:
+            pytesseract.get_tesseract_version()
+        except Exception:
+            return False
+        return True
+
+    def _detect(self, content):
+        data = pytesseract.image_to_data(
+            Image.open(io.BytesIO(content)), lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+
+        words = []
+        lines = []
+        current_line = None
+        for i, word in enumerate(data['text']):
+            word = word.strip()
+            if not word:
+                continue
+            left, top = data['left'][i], data['top'][i]
+            words.append(box_annotation(word, left, top, left + data['width'][i], top + data['height'][i]))
+
+            line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            if line != current_line:
+                lines.append([])
+                current_line = line
+            lines[-1].append(word)
+
+        text = '\n'.join(' '.join(line) for line in lines)
+        if not words:
+            return OcrResult('', [])
+        full_text = box_annotation(
+            text,
+            min(word.bounding_poly.vertices[0].x for word in words),
+            min(word.bounding_poly.vertices[0].y for word in words),
+            max(word.bounding_poly.vertices[2].x for word in words),
+            max(word.bounding_poly.vertices[2].y for word in words))
+        return OcrResult(text, [full_text] + words)
+
+
+class GoogleVisionEngine(OcrEngine):
+    """
+    Google Vision document text detection. `client` can be any object with the
+    document_text_detection and batch_annotate_images methods of
+    vision.ImageAnnotatorClient, e.g. a local fake; by default the process wide client
+    of get_vision_client is used, created on the first call. `types` provides the
+    Image, AnnotateImageRequest and Feature request types, google.cloud.vision by default,
+    so a fake client can be used without the Vision library installed.
+    """
+
+    name = 'google_vision'
+
+    def __init__(self, client=None, batch_size=VISION_BATCH_SIZE, types=None):
+        super().__init__()
+        self._client = client
+        self._types = types
+        self.batch_size = batch_size
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_vision_client()
+        return self._client
+
+    @property
+    def vision(self):
+        if self._types is not None:
+            return self._types
+        from google.cloud import vision
+
+        return vision
+
+    def _result(self, response):
+        if response.error.message:
+            raise RuntimeError(f"Vision API error: {response.error.message}")
+        if not response.text_annotations:
+            return OcrResult('', [])
+        return OcrResult(response.full_text_annotation.text, list(response.text_annotations))
+
+    def _detect(self, content):
+        return self._result(self.client.document_text_detection(image=self.vision.Image(content=content)))
+
+    def detect_batch(self, contents):
+        """OCR the images with one batch_annotate_images call per `batch_size` images."""
+        results = []
+        for start in range(0, len(contents), self.batch_size):
+            chunk = contents[start:start + self.batch_size]
+            requests = [
+                self.vision.AnnotateImageRequest(
+                    image=self.vision.Image(content=content),
+                    features=[self.vision.Feature(type_=self.vision.Feature.Type.DOCUMENT_TEXT_DETECTION)],
+                )
+                for content in chunk
+            ]
+            batch_start = time.perf_counter()
+            try:
+                response = self.client.batch_annotate_images(requests=requests)
+            except Exception as e:
+                self._record(time.perf_counter() - batch_start, len(chunk), True)
+                LOGGER.error(f"Vision API batch error: {e}")
+                results.extend([None] * len(chunk))
+                continue
+            self._record(time.perf_counter() - batch_start, len(chunk), False)
+
+            for image_response in response.responses:
+                try:
+                    results.append(self._result(image_response))
+                except Exception as e:
+                    LOGGER.error(str(e))
+                    results.append(None)
+        return results
+
+
+def get_vision_client():
+    """
+    vision.ImageAnnotatorClient shared by the process. The Vision library is only imported,
+    and the gRPC channel and credentials only set up, the first time it is needed.
+    """
+    global _vision_client
+    with _vision_client_lock:
+        if _vision_client is None:
+            from google.cloud import vision
+
+            _vision_client = vision.ImageAnnotatorClient()
+        return _vision_client
+
+
+def build_ocr_engines(vision_client=None):
+    """
+    OCR engines in the order they are tried, from OCR_ENGINES (default 'tesseract,google_vision').
+    Tesseract is skipped when it is not installed.
+    """
+    engines = []
+    for name in os.getenv('OCR_ENGINES', 'tesseract,google_vision').split(','):
+        name = name.strip().lower()
+        if name == TesseractEngine.name:
+            if TesseractEngine.available():
+                engines.append(TesseractEngine(lang=os.getenv('TESSERACT_LANG', 'eng'), config=os.getenv('TESSERACT_CONFIG', '')))
+            else:
+                LOGGER.warning("Tesseract is not installed, skipping the local OCR engine")
+        elif name == GoogleVisionEngine.name:
+            engines.append(GoogleVisionEngine(client=vision_client))
+        elif name:
+            raise ValueError(f"Unknown OCR engine {name}")
+    if not engines:
+        raise ValueError("No OCR engine available")
+    return engines
+
+
+def detect_with_escalation(engines, content, missing_fields):
+    """
+    Run the engines in order until one finds every key field.
+
+    Args:
+        engines (list): OcrEngine instances, cheapest first
+        content (bytes): Encoded image
+        missing_fields (callable): Returns (missing, expected) key field counts of an OcrResult
+
+    Returns:
+        tuple: (OcrResult with the fewest missing fields or None, the engine that produced it)
+    """
+    best = (None, None, None)
+    for engine in engines:
+        try:
+            result = engine.detect(content)
+        except Exception as e:
+            LOGGER.error(f"{engine.name} OCR error: {e}")
+            continue
+        missing, expected = missing_fields(result)
+        engine.record_accuracy(expected - missing, expected)
+        if best[0] is None or missing < best[2]:
+            best = (result, engine, missing)
+        if not missing:
+            break
+        LOGGER.info(f"{engine.name} missed {missing} of {expected} key fields, escalating")
+    return best[0], best[1]
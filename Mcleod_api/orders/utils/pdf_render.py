@@ -0,0 +1,109 @@
+# orders/utils/pdf_render.py
+import io
+import logging
+import os
+from collections import namedtuple
+
+import pdfplumber
+
+LOGGER = logging.getLogger("orders.utils.pdf_render")
+
+RenderSettings = namedtuple('RenderSettings', ['dpi', 'thread_count', 'use_pdftocairo', 'grayscale', 'jpeg_quality'])
+
+# Fraction of the page kept above the first label, so the label itself is OCRed
+REGION_MARGIN = 0.02
+
+
+def render_settings_from_env():
+    """Rasterization settings of the OCR fallback, tuned for text rather than fidelity."""
+    return RenderSettings(
+        dpi=int(os.getenv('VISION_RENDER_DPI', '200')),
+        thread_count=int(os.getenv('VISION_RENDER_THREADS', '1')),
+        use_pdftocairo=os.getenv('VISION_RENDER_PDFTOCAIRO', 'false').lower() == 'true',
+        grayscale=os.getenv('VISION_RENDER_GRAYSCALE', 'true').lower() == 'true',
+        jpeg_quality=int(os.getenv('VISION_RENDER_JPEG_QUALITY', '85')),
+    )
+
+
+def parse_crop_box(value):
+    """'left,top,right,bottom' page fractions to a tuple, None for an empty value."""
+    if not value:
+        return None
+    box = tuple(float(part) for part in value.split(','))
+    if len(box) != 4:
+        raise ValueError(f"Crop box needs 4 fractions, got {value}")
+    return box
+
+
+def find_label_region(pdf_path, start_labels, end_labels, page_number=1):
+    """
+    Locate the band of a page between the first of `start_labels` and the first of
+    `end_labels` below it, using the word boxes of the PDF text layer.
+
+    Args:
+        pdf_path (str): PDF file
+        start_labels (list): Labels opening the region, e.g. ['PICK UP', 'SHIP TO']
+        end_labels (list): Labels closing the region, e.g. ['CARRIER', 'NOTES']
+        page_number (int): 1-based page
+
+    Returns:
+        tuple: (left, top, right, bottom) as page fractions, None when no start label is found
+    """
+    with pdfplumber.open(pdf_path) as pdf:
+        page = pdf.pages[page_number - 1]
+        words = page.extract_words()
+        height = float(page.height)
+
+    texts = [word['text'].upper() for word in words]
+
+    def label_tops(labels):
+        tops = []
+        for label in labels:
+            tokens = label.upper().split()
+            for i in range(len(texts) - len(tokens) + 1):
+                if texts[i:i + len(tokens)] == tokens:
+                    tops.append(float(words[i]['top']))
+        return tops
+
+    start_tops = label_tops(start_labels)
+    if not start_tops:
+        return None
+    top = min(start_tops)
+    end_tops = [end_top for end_top in label_tops(end_labels) if end_top > max(start_tops)]
+    bottom = min(end_tops) if end_tops else height
+
+    return 0.0, max(0.0, top / height - REGION_MARGIN), 1.0, min(1.0, bottom / height + REGION_MARGIN)
+
+
+def render_page_jpeg(pdf_path, settings, page_number=1, crop_box=None, poppler_path=None):
+    """
+    Rasterize one page of a PDF into JPEG bytes, entirely in memory.
+
+    Args:
+        pdf_path (str): PDF file
+        settings (RenderSettings): DPI, poppler threads, renderer, color and JPEG quality
+        page_number (int): 1-based page
+        crop_box (tuple): (left, top, right, bottom) page fractions to keep, the whole page if None
+
+    Returns:
+        bytes: The encoded image, None when the page could not be rendered
+    """
+    from pdf2image import convert_from_path
+
+    images = convert_from_path(
+        pdf_path, dpi=settings.dpi, first_page=page_number, last_page=page_number,
+        thread_count=settings.thread_count, use_pdftocairo=settings.use_pdftocairo,
+        grayscale=settings.grayscale, poppler_path=poppler_path)
+    if not images:
+        LOGGER.error(f"Failed to convert PDF to image: {pdf_path}")
+        return None
+
+    image = images[0]
+    if crop_box:
+        left, top, right, bottom = crop_box
+        image = image.crop((int(left * image.width), int(top * image.height),
+                            int(right * image.width), int(bottom * image.height)))
+
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=settings.jpeg_quality, optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,48 @@
+# orders/utils/sql_batch.py
+import re
+
+# SQL Server accepts at most 2100 parameters per statement, keep some room
+MAX_SQL_PARAMS = 2000
+
+
+def chunked(items, size):
+    """Yield consecutive slices of `items` with at most `size` elements."""
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def in_clause(values, prefix='value'):
+    """
+    Build the placeholders of an IN (...) list and its parameters.
+
+    Example:
+        in_clause(['a', 'b'], 'bol') -> (':bol_0, :bol_1', {'bol_0': 'a', 'bol_1': 'b'})
+    """
+    params = {f'{prefix}_{i}': value for i, value in enumerate(values)}
+    return ', '.join(f':{name}' for name in params), params
+
+
+def values_clause(rows, row_template):
+    """
+    Build a multi-row VALUES list from a row template with named parameters.
+
+    Args:
+        rows (list): One dict of parameters per row
+        row_template (str): Row with named placeholders, e.g. "(:bol, :status, 0)"
+
+    Returns:
+        tuple: The comma separated rows and the merged parameters, each row with its own suffix
+    """
+    placeholders = []
+    params = {}
+    for i, row in enumerate(rows):
+        placeholders.append(re.sub(r':(\w+)', rf':\1_{i}', row_template))
+        params.update({f'{name}_{i}': value for name, value in row.items()})
+    return ',\n'.join(placeholders), params
+
+
+def rows_per_statement(row_template):
+    """How many rows of `row_template` fit in one statement, also capped by the 1000 rows VALUES limit."""
+    params_per_row = max(1, len(set(re.findall(r':(\w+)', row_template))))
+    return max(1, min(1000, MAX_SQL_PARAMS // params_per_row))
@@ -0,0 +1,91 @@
+# orders/utils/ttl_cache.py
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Size bounded LRU cache whose entries expire after a time to live.
+
+    Negative results (`None` values, or values stored with negative=True) are cached like
+    any other value, optionally with their own shorter `negative_ttl`. Hit, miss,
+    expiration and eviction counters are kept to size the cache.
+    """
+
+    def __init__(self, max_size=1024, ttl=900, negative_ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Get a cached value.
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss or an expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return False, None
+
+            value, expires_at, negative = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            if negative:
+                self.negative_hits += 1
+            return True, value
+
+    def peek(self, key):
+        """Like get, without counting a hit or a miss or refreshing the LRU position of the entry."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or time.monotonic() >= entry[1]:
+                return False, None
+            return True, entry[0]
+
+    def set(self, key, value, negative=None):
+        if negative is None:
+            negative = value is None
+        with self._lock:
+            ttl = self.negative_ttl if negative else self.ttl
+            self._entries[key] = (value, time.monotonic() + ttl, negative)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'expirations': self.expirations,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,52 @@
+# tests/fake_vision.py
+"""
+Local fake of vision.ImageAnnotatorClient and of the request types GoogleVisionEngine
+builds, so the OCR fallback can run without credentials or the Vision library:
+
+    engine = GoogleVisionEngine(client=FakeImageAnnotatorClient(texts), types=FAKE_VISION_TYPES)
+"""
+from types import SimpleNamespace
+
+from orders.utils.ocr_engines import box_annotation
+
+
+class _Feature(SimpleNamespace):
+    Type = SimpleNamespace(DOCUMENT_TEXT_DETECTION='DOCUMENT_TEXT_DETECTION')
+
+
+FAKE_VISION_TYPES = SimpleNamespace(Image=SimpleNamespace, AnnotateImageRequest=SimpleNamespace, Feature=_Feature)
+
+
+def annotate_image_response(text):
+    """AnnotateImageResponse of a text, one word annotation per token after the full text one."""
+    words = [box_annotation(word, 10 * i, 0, 10 * i + 8, 10) for i, word in enumerate(text.split())]
+    annotations = [box_annotation(text, 0, 0, 10 * len(words), 10)] + words if words else []
+    return SimpleNamespace(error=SimpleNamespace(message=''), text_annotations=annotations,
+                           full_text_annotation=SimpleNamespace(text=text))
+
+
+class FakeImageAnnotatorClient:
+    """
+    Answers with the text registered for each image content, '' for unknown images, and
+    records every image it was asked to annotate.
+
+    Args:
+        texts (dict): Text to detect per image content (bytes)
+    """
+
+    def __init__(self, texts=None):
+        self.texts = texts or {}
+        self.annotated = []
+        self.batch_calls = 0
+
+    def document_text_detection(self, image):
+        self.annotated.append(image.content)
+        return annotate_image_response(self.texts.get(image.content, ''))
+
+    def batch_annotate_images(self, requests):
+        self.batch_calls += 1
+        responses = []
+        for request in requests:
+            self.annotated.append(request.image.content)
+            responses.append(annotate_image_response(self.texts.get(request.image.content, '')))
+        return SimpleNamespace(responses=responses)
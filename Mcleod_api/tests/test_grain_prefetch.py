@@ -0,0 +1,71 @@
+# tests/test_grain_prefetch.py
+from types import SimpleNamespace
+
+from orders.grain.grain_order_entry import GrainOrderEntry
+from orders.location_resolver import get_resolution_cache
+
+
+class FakeResolver:
+    """Resolves the pickups and the consignee addresses of `known`, nothing else."""
+
+    def __init__(self, known):
+        self.known = known
+        self.consignee_lookups = 0
+
+    def match_pickup(self, address):
+        return [SimpleNamespace(id='KENMIA')]
+
+    def match_consignee(self, address, match_second_token=True):
+        self.consignee_lookups += 1
+        return [SimpleNamespace(id='LOADIL')] if address in self.known else []
+
+    def fuzzy_match(self, address, stop_type, name=None):
+        return None
+
+
+class RecordingFallback:
+    def __init__(self):
+        self.prefetched = []
+
+    def prefetch(self, pdf_paths):
+        self.prefetched.extend(pdf_paths)
+
+
+class PrefetchGrainOrderEntry(GrainOrderEntry):
+    def __init__(self, db):
+        # Only what the prefetch reads, without the configuration of a full client
+        self.db = db
+        self._local_resolutions = {}
+        self.fallback = RecordingFallback()
+
+    @property
+    def vision_fallback(self):
+        return self.fallback
+
+    def _order_pdf_path(self, elem):
+        return elem['origin_file']
+
+
+def order(bol, consignee):
+    return {'bol': bol, 'PU_details': ['4815 55TH MUSCATINE IA 52761', '01/02/2025'],
+            'SO_details': [consignee, '01/03/2025'], 'so_company': 'LOAD CO', 'origin_file': f'{bol}.pdf'}
+
+
+def test_prefetch_queues_one_document_per_unresolved_address():
+    client = PrefetchGrainOrderEntry(SimpleNamespace(database_name='TEST_PREFETCH'))
+    resolver = FakeResolver(known={'123 MAIN ST SPRINGFIELD IL'})
+    orders = [
+        order('1LID1', '123 MAIN ST SPRINGFIELD IL'),
+        order('1LID2', '999 NOWHERE RD SPRINGFIELD IL'),
+        order('1LID3', '999 NOWHERE RD SPRINGFIELD IL'),
+        order('1LID4', '1 CACHED MISS RD PEORIA IL'),
+    ]
+    cache = get_resolution_cache()
+    cache.set(client._resolution_key(orders[3], 'SO'), (None, 'Location code not found'), negative=True)
+
+    client._prefetch_vision_fallback(resolver, orders)
+
+    assert client.fallback.prefetched == ['1LID2.pdf']
+    # The lookups reuse the local resolutions of the prefetch
+    client._resolve_locally(resolver, orders[1], 'SO')
+    assert resolver.consignee_lookups == 2
@@ -0,0 +1,90 @@
+# tests/test_grain_vision_fallback.py
+import os
+import time
+
+from fake_vision import FAKE_VISION_TYPES, FakeImageAnnotatorClient
+
+from orders.grain.grain_vision_fallback import GrainVisionFallback
+from orders.utils.extraction_manifest import file_sha256
+from orders.utils.ocr_engines import GoogleVisionEngine
+
+BOL_TEXT = """PICK UP
+4815 55TH
+MUSCATINE IA 52761
+SHIP DATE 01/02/2025
+SHIP TO
+123 MAIN ST
+SPRINGFIELD IL 62701
+CARRIER"""
+
+
+def make_fallback(cache_dir, client, **cache_bounds):
+    fallback = GrainVisionFallback(
+        cache_dir=str(cache_dir), engines=[GoogleVisionEngine(client=client, types=FAKE_VISION_TYPES)], **cache_bounds)
+    # The fake client answers per image content, the PDF bytes stand in for the rendered page
+    fallback._render_first_page = lambda pdf_path: open(pdf_path, 'rb').read()
+    return fallback
+
+
+def write_documents(tmp_path, contents):
+    paths = []
+    for i, content in enumerate(contents):
+        path = tmp_path / f'1LID{i}.pdf'
+        path.write_bytes(content)
+        paths.append(str(path))
+    return paths
+
+
+def test_prefetch_ocrs_each_document_once_in_one_batch(tmp_path):
+    # 1LID0 and 1LID1 are the same document saved twice
+    paths = write_documents(tmp_path, [b'bol-a', b'bol-a', b'bol-b'])
+    client = FakeImageAnnotatorClient({b'bol-a': BOL_TEXT, b'bol-b': BOL_TEXT})
+    fallback = make_fallback(tmp_path / 'ocr_cache', client)
+
+    fallback.prefetch(paths)
+    locations = [fallback.extract_location_from_pdf(path) for path in paths]
+
+    assert client.batch_calls == 1
+    assert sorted(client.annotated) == [b'bol-a', b'bol-b']
+    assert all(location['SO']['zip_code'] == '62701' for location in locations)
+    assert fallback.engine_stats()['google_vision']['calls'] == 2
+
+
+def test_ocr_cache_is_reused_by_a_new_process(tmp_path):
+    paths = write_documents(tmp_path, [b'bol-a'])
+    make_fallback(tmp_path / 'ocr_cache', FakeImageAnnotatorClient({b'bol-a': BOL_TEXT})).extract_location_from_pdf(paths[0])
+
+    client = FakeImageAnnotatorClient({b'bol-a': BOL_TEXT})
+    location = make_fallback(tmp_path / 'ocr_cache', client).extract_location_from_pdf(paths[0])
+
+    assert client.annotated == []
+    assert location['PU']['state'] == 'IA'
+
+
+def write_cache_entries(cache_dir, ages_in_days):
+    cache_dir.mkdir()
+    now = time.time()
+    for i, age in enumerate(ages_in_days):
+        path = cache_dir / f'hash{i}.json'
+        path.write_text('{"text": ""}')
+        os.utime(path, (now - age * 86400, now - age * 86400))
+
+
+def test_expired_ocr_cache_files_are_pruned_on_startup(tmp_path):
+    write_cache_entries(tmp_path / 'ocr_cache', [1, 10, 40])
+
+    make_fallback(tmp_path / 'ocr_cache', FakeImageAnnotatorClient({}), cache_max_age_days=30)
+
+    assert sorted(os.listdir(tmp_path / 'ocr_cache')) == ['hash0.json', 'hash1.json']
+
+
+def test_least_recently_used_ocr_cache_files_are_pruned_over_the_limit(tmp_path):
+    write_cache_entries(tmp_path / 'ocr_cache', [3, 2, 1])
+    paths = write_documents(tmp_path, [b'bol-a'])
+    fallback = make_fallback(
+        tmp_path / 'ocr_cache', FakeImageAnnotatorClient({b'bol-a': BOL_TEXT}), cache_max_files=3)
+
+    fallback.extract_location_from_pdf(paths[0])
+
+    assert sorted(os.listdir(tmp_path / 'ocr_cache')) == sorted(
+        ['hash1.json', 'hash2.json', f'{file_sha256(paths[0])}.json'])
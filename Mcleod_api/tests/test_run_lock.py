@@ -0,0 +1,53 @@
+# tests/test_run_lock.py
+import threading
+import time
+
+from orders.run_lock import RunLock
+
+
+class FakeLockTable:
+    """Single lock row kept in memory, answering the queries of RunLock."""
+
+    def __init__(self, renewal_delay=0.0):
+        self.owner = None
+        self.renewal_delay = renewal_delay
+        self.renewing = threading.Event()
+
+    def execute_write_query(self, query, params):
+        if 'SET owner = :owner' in query:
+            if self.owner is None:
+                self.owner = params['owner']
+        elif 'SET owner = NULL' in query:
+            if self.owner == params['owner']:
+                self.owner = None
+        elif 'SET expires_at' in query:
+            self.renewing.set()
+            time.sleep(self.renewal_delay)
+
+    def execute_read_query(self, query, params):
+        return [(self.owner,)] if self.owner else []
+
+
+def test_release_during_a_renewal_does_not_report_the_lock_lost():
+    table = FakeLockTable(renewal_delay=0.1)
+    lock = RunLock(table, 'grain', 'order_entry_run_locks', ttl=0.03)
+    assert lock.acquire()
+
+    assert table.renewing.wait(timeout=5)
+    lock.release()
+    # Let a renewal still in flight finish
+    time.sleep(0.2)
+
+    assert table.owner is None
+    assert not lock.lost.is_set()
+
+
+def test_lock_taken_by_another_process_is_reported_lost():
+    table = FakeLockTable()
+    lock = RunLock(table, 'grain', 'order_entry_run_locks', ttl=0.03)
+    assert lock.acquire()
+
+    table.owner = 'other-host:1:abcd'
+
+    assert lock.lost.wait(timeout=5)
+    lock.release()
@@ -0,0 +1,74 @@
+# tools/apply_migrations.py
+"""
+Apply the SQL scripts of the migrations folder to the database of the app, in file name order.
+
+The table names in the scripts are filled in from the variables the app reads them from,
+AUTORATE_JOBS_TABLE and RUN_LOCK_TABLE, with the same defaults, so the tables created
+are the ones the app uses. Every script can be run again. Apply them before starting a
+version of the app that needs a new script. Run it from the Mcleod_api folder, like the app:
+
+    python -m tools.apply_migrations
+    python -m tools.apply_migrations --dry-run    # only print the SQL
+"""
+import argparse
+import os
+import re
+
+from dotenv import load_dotenv
+
+MIGRATIONS_PATH = 'migrations'
+
+# Placeholder of the scripts -> (environment variable, default) of the table name
+TABLE_NAMES = {
+    'autorate_jobs_table': ('AUTORATE_JOBS_TABLE', 'order_entry_autorate_jobs'),
+    'run_lock_table': ('RUN_LOCK_TABLE', 'order_entry_run_locks'),
+}
+
+
+def table_names():
+    names = {}
+    for placeholder, (variable, default) in TABLE_NAMES.items():
+        name = os.getenv(variable, default)
+        if not re.fullmatch(r'\w+', name):
+            raise ValueError(f"{variable} is not a valid table name: {name}")
+        names[placeholder] = name
+    return names
+
+
+def migration_batches(path=MIGRATIONS_PATH):
+    """(script name, SQL batch) of every script, split on its GO lines like sqlcmd does."""
+    names = table_names()
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith('.sql'):
+            continue
+        with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f:
+            sql = f.read().format(**names)
+        for batch in re.split(r'^\s*GO\s*$', sql, flags=re.MULTILINE | re.IGNORECASE):
+            if batch.strip():
+                yield file_name, batch.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Apply the SQL migrations of the order entry app.')
+    parser.add_argument('--dry-run', action='store_true', help='Print the SQL instead of running it')
+    args = parser.parse_args()
+
+    load_dotenv('config.env')
+    db = None
+    if not args.dry_run:
+        from database import DatabaseHandler
+
+        db = DatabaseHandler()
+
+    for file_name, batch in migration_batches():
+        if db is None:
+            print(f'-- {file_name}\n{batch}\nGO\n')
+            continue
+        print(f'Applying {file_name}')
+        db.execute_write_query(batch)
+    if db is not None:
+        print('Migrations applied')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# tools/bench_vision_render.py
+"""
+Benchmark of the page rendering settings of the Vision fallback.
+
+Renders the first page of each PDF with every combination of the given DPIs, poppler
+thread counts and renderers, with and without the PICK UP / SHIP TO crop, and prints the
+average render time and upload size of each. Add --ocr to also send the images to the
+OCR engines and check that the stop addresses are still parsed. Run it from the Mcleod_api
+folder, like the app:
+
+    python -m tools.bench_vision_render orders/*.pdf --dpi 150 200 300 --threads 1 4 --pdftocairo
+"""
+import argparse
+import itertools
+import time
+
+from orders.grain.grain_vision_fallback import LOCATION_END_LABELS, LOCATION_START_LABELS, GrainVisionFallback
+from orders.utils.ocr_engines import detect_with_escalation
+from orders.utils.pdf_render import RenderSettings, find_label_region, render_page_jpeg
+
+
+def bench(pdf_paths, settings, crop, repeat):
+    seconds = 0.0
+    sizes = []
+    images = {}
+    for pdf_path in pdf_paths:
+        crop_box = find_label_region(pdf_path, LOCATION_START_LABELS, LOCATION_END_LABELS) if crop else None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            content = render_page_jpeg(pdf_path, settings, crop_box=crop_box)
+            seconds += time.perf_counter() - start
+        images[pdf_path] = content
+        sizes.append(len(content or b''))
+    return 1000 * seconds / (len(pdf_paths) * repeat), sum(sizes) / len(sizes), images
+
+
+def parsed_fields(fallback, images):
+    """Key fields (PU/SO state and zip) parsed from the OCR text of the rendered images."""
+    found = expected = 0
+    for content in images.values():
+        result, _ = detect_with_escalation(fallback.engines, content, fallback._missing_fields)
+        if result is None:
+            continue
+        missing, fields = fallback._missing_fields(result)
+        found += fields - missing
+        expected += fields
+    return f'{found}/{expected}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the rendering settings of the Vision fallback.')
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('--dpi', type=int, nargs='+', default=[150, 200, 300])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1])
+    parser.add_argument('--pdftocairo', action='store_true', help='Also measure pdftocairo next to pdftoppm')
+    parser.add_argument('--color', action='store_true', help='Render in color instead of grayscale')
+    parser.add_argument('--jpeg-quality', type=int, default=85)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--ocr', action='store_true', help='OCR each variant with the OCR engines')
+    args = parser.parse_args()
+
+    fallback = GrainVisionFallback() if args.ocr else None
+    renderers = [False, True] if args.pdftocairo else [False]
+
+    print(f"{'dpi':>5} {'threads':>7} {'renderer':>10} {'crop':>5} {'ms/page':>9} {'kB/page':>9}" + (' fields' if args.ocr else ''))
+    for dpi, threads, use_pdftocairo, crop in itertools.product(args.dpi, args.threads, renderers, [False, True]):
+        settings = RenderSettings(dpi, threads, use_pdftocairo, not args.color, args.jpeg_quality)
+        ms, size, images = bench(args.pdfs, settings, crop, args.repeat)
+        line = f"{dpi:>5} {threads:>7} {'pdftocairo' if use_pdftocairo else 'pdftoppm':>10} {str(crop):>5} {ms:>9.1f} {size / 1024:>9.1f}"
+        if fallback:
+            line += f' {parsed_fields(fallback, images)}'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# tools/lme_api_stub.py
+"""
+Local stand-in for the McLeod LME API endpoints used by post_orders.
+
+Implements PUT /orders/create and POST /orders/autorate/{id} with the response fields the
+order entry code reads, plus GET /stats. Latency, error rate and rate limit are configurable,
+so posting throughput and retry behavior can be measured without the real API.
+
+Usage:
+    python tools/lme_api_stub.py --port 8099 --latency-ms 250 --jitter-ms 100 --error-rate 0.02 --rate-limit 20
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, rate_limit=None, autorate_latency_ms=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.autorate_latency_ms = latency_ms if autorate_latency_ms is None else autorate_latency_ms
+        self.orders = {}
+        self.stats = {'create': 0, 'autorate': 0, 'errors': 0, 'rate_limited': 0}
+        self._ids = itertools.count(1)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def rate_limited(self):
+        """Fixed one second window limit, None means unlimited."""
+        if not self.rate_limit:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1:
+                self._window_start, self._window_count = now, 0
+            self._window_count += 1
+            return self._window_count > self.rate_limit
+
+    def delay(self, base_ms):
+        time.sleep(max(0.0, random.gauss(base_ms, self.jitter_ms)) / 1000 if self.jitter_ms else base_ms / 1000)
+
+
+def make_handler(state):
+    class LmeApiStubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _read_body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length).decode() if length else ''
+
+        def _fail_if_unlucky(self, base_ms):
+            if state.rate_limited():
+                state.count('rate_limited')
+                self._send(429, {'error': 'Too many requests'})
+                return True
+            state.delay(base_ms)
+            if random.random() < state.error_rate:
+                state.count('errors')
+                self._send(500, {'error': 'Simulated server error'})
+                return True
+            return False
+
+        def do_PUT(self):
+            body = self._read_body()
+            if self.path != '/orders/create':
+                self._send(404, {'error': f'Unknown path {self.path}'})
+                return
+            if self._fail_if_unlucky(state.latency_ms):
+                return
+            try:
+                order = json.loads(body)
+            except json.JSONDecodeError:
+                self._send(400, {'error': 'Invalid JSON payload'})
+                return
+
+            order_id = state.next_id()
+            response = {
+                'id': str(order_id),
+                'blnum': order.get('blnum'),
+                'shipper_stop_id': f'{order_id}-1',
+                'consignee_stop_id': f'{order_id}-2',
+                'consignee_refno': order.get('consignee_refno'),
+                'customer_id': order.get('customer_id'),
+            }
+            state.orders[str(order_id)] = response
+            state.count('create')
+            self._send(200, response)
+
+        def do_POST(self):
+            self._read_body()
+            match = re.fullmatch(r'/orders/autorate/(\w+)', self.path)
+            if not match:
+                self._send(404, {'error': f'Unknown path {self.path}'})
+                return
+            if self._fail_if_unlucky(state.autorate_latency_ms):
+                return
+            if match.group(1) not in state.orders:
+                self._send(404, {'error': f'Order {match.group(1)} not found'})
+                return
+            state.count('autorate')
+            self._send(200, {'id': match.group(1), 'rated': True})
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send(200, dict(state.stats, orders=len(state.orders)))
+            else:
+                self._send(404, {'error': f'Unknown path {self.path}'})
+
+    return LmeApiStubHandler
+
+
+def start_stub_server(host='127.0.0.1', port=0, **options):
+    """Start the stub in a daemon thread. Returns (server, base url, state)."""
+    state = StubState(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}', state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the LME orders API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=200.0, help='Mean latency of each call')
+    parser.add_argument('--autorate-latency-ms', type=float, default=None, help='Mean latency of autorate, defaults to --latency-ms')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='Standard deviation of the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of calls answered with a 500')
+    parser.add_argument('--rate-limit', type=int, default=None, help='Requests per second before answering 429')
+    args = parser.parse_args()
+
+    server, url, _ = start_stub_server(
+        args.host, args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        rate_limit=args.rate_limit, autorate_latency_ms=args.autorate_latency_ms)
+    print(f'LME API stub listening on {url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
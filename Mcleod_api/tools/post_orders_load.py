@@ -0,0 +1,130 @@
+# tools/post_orders_load.py
+"""
+Load harness for GrainOrderEntry.post_orders against the local LME API stub.
+
+Runs post_orders over N synthetic downloaded orders with an in-memory stand-in for the
+database, and prints the wall clock time, throughput, outcome counts and the LME client
+latency stats. Run it from the Mcleod_api folder, like the app:
+
+    python -m tools.post_orders_load --orders 300 --post-workers 8 --latency-ms 250 --error-rate 0.02
+
+The LME client throttles itself with LME_API_RATE_LIMIT / LME_API_BURST (5 rps by default);
+raise them with --client-rate-limit and --client-burst so the run measures the workers
+rather than that cap.
+"""
+import argparse
+import datetime
+import os
+import re
+import threading
+import time
+
+from orders.client import Client
+from orders.grain.grain_order_entry import GrainOrderEntry
+
+from tools.lme_api_stub import start_stub_server
+
+
+class InMemoryOrdersDb:
+    """Answers the queries post_orders sends, keeping the order statuses in memory."""
+
+    database_name = 'LME_LOAD_TEST'
+    lme_api_user = 'load'
+    lme_api_pw = 'test'
+
+    def __init__(self, lme_api, rows, latency_ms=0.0):
+        self.lme_api = lme_api
+        self.rows = {row[0]: row for row in rows}
+        self.statuses = {bol: 'downloaded' for bol in self.rows}
+        self.latency = latency_ms / 1000
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def execute_read_query(self, query, params=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.reads += 1
+            if "[order_status] IN ('downloaded')" in query:
+                return [row for bol, row in self.rows.items() if self.statuses[bol] == 'downloaded']
+            return []
+
+    def execute_write_query(self, query, params=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.writes += 1
+            if re.search(r'SET order_status = :new_status', query):
+                self.statuses[params['bol']] = params['new_status']
+
+
+class LoadTestGrainOrderEntry(GrainOrderEntry):
+    def handle_attachment(self, order_resp):
+        # BOL imaging is not part of what this harness measures
+        return True
+
+
+def synthetic_rows(count):
+    today = datetime.date.today().strftime('%Y%m%d')
+    window = f'{today}120100-0600|{today}235900-0600'
+    rows = []
+    for i in range(count):
+        bol = f'1LID{900000 + i}'
+        rows.append((
+            bol, f'PO{i}', f'S{i}', 'P', 'GRAMIA', f'{today}000000-0600', 'V', 'FOOD INGREDIENTS', 'FOOD-ING',
+            'dbangert', 'V', '4815 55TH MUSCATINE IA 52761', 'KENMIA', 'IA', '123 MAIN ST SPRINGFIELD IL', 'LOADIL',
+            'IL', window, window, 'downloaded', 0, f'{bol}.pdf', 'Processed - updated', None, None,
+        ))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure GrainOrderEntry.post_orders against the LME API stub.')
+    parser.add_argument('--orders', type=int, default=100)
+    parser.add_argument('--post-workers', type=int, default=1)
+    parser.add_argument('--autorate-workers', type=int, default=2)
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--jitter-ms', type=float, default=50.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=int, default=None, help='Requests per second the stub accepts before answering 429')
+    parser.add_argument('--client-rate-limit', type=float, default=None, help='LME_API_RATE_LIMIT of the client, requests per second')
+    parser.add_argument('--client-burst', type=int, default=None, help='LME_API_BURST of the client')
+    parser.add_argument('--db-latency-ms', type=float, default=5.0)
+    parser.add_argument('--api-url', default=None, help='Use an already running stub instead of starting one')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TABLE_ORDERS_DEV', 'order_entry_data_load_test')
+    os.environ['LME_POST_WORKERS'] = str(args.post_workers)
+    os.environ['AUTORATE_WORKERS'] = str(args.autorate_workers)
+    if args.client_rate_limit is not None:
+        os.environ['LME_API_RATE_LIMIT'] = str(args.client_rate_limit)
+    if args.client_burst is not None:
+        os.environ['LME_API_BURST'] = str(args.client_burst)
+
+    stub_state = None
+    api_url = args.api_url
+    if api_url is None:
+        _, api_url, stub_state = start_stub_server(
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, rate_limit=args.rate_limit)
+
+    Client._lme_api_clients.clear()
+    db = InMemoryOrdersDb(api_url, synthetic_rows(args.orders), latency_ms=args.db_latency_ms)
+    grain = LoadTestGrainOrderEntry(db)
+
+    start = time.perf_counter()
+    grain.post_orders()
+    elapsed = time.perf_counter() - start
+
+    print()
+    print(f'orders: {args.orders}, post workers: {args.post_workers}, autorate workers: {args.autorate_workers}')
+    print(f'elapsed: {elapsed:.2f}s, throughput: {len(grain.posted_orders) / elapsed:.2f} orders/s')
+    print(f'posted: {len(grain.posted_orders)}, failed: {len(grain.failed_orders)}, deferred: {len(grain.deferred_orders)}')
+    print(f'db reads: {db.reads}, db writes: {db.writes}')
+    rate_limiter = grain.lme_api_client.rate_limiter
+    print(f'client rate limit: {rate_limiter.max_rate:g} rps, burst: {rate_limiter.capacity}, rate at the end: {rate_limiter.rate:g} rps')
+    print(f'LME client: {grain.lme_api_client.latency_stats()}')
+    if stub_state:
+        print(f'stub: {stub_state.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# compare_layout.py
+"""
+Compare organize_annotations with organize_annotations_legacy on recorded annotations.
+
+Each file is a Vision response saved as JSON (e.g. AnnotateImageResponse.to_json(response)),
+or a list of {"description": ..., "vertices": [[x, y], ...]} words whose first entry is the
+full text. For each file the script prints the time of both layouts, whether they return the
+same words, and how similar their order is. Run it from the repository root.
+
+    python -m vision.compare_layout recorded/*.json
+"""
+import argparse
+import difflib
+import json
+import time
+from collections import Counter
+
+from Mcleod_api.orders.utils.ocr_engines import box_annotation
+from vision.vision_api import organize_annotations, organize_annotations_legacy
+
+
+def load_annotations(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        words = data.get('textAnnotations') or data.get('text_annotations') or []
+        words = [
+            {
+                'description': word['description'],
+                'vertices': [(vertex.get('x', 0), vertex.get('y', 0))
+                             for vertex in (word.get('boundingPoly') or word.get('bounding_poly'))['vertices']],
+            }
+            for word in words
+        ]
+    else:
+        words = data
+
+    annotations = []
+    for word in words:
+        xs = [vertex[0] for vertex in word['vertices']]
+        ys = [vertex[1] for vertex in word['vertices']]
+        annotations.append(box_annotation(word['description'], min(xs), min(ys), max(xs), max(ys)))
+    return annotations
+
+
+def timed(layout, annotations, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        text = layout(annotations)
+    return text, 1000 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the vectorized and legacy annotation layouts.')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--show-diff', action='store_true')
+    args = parser.parse_args()
+
+    for path in args.files:
+        annotations = load_annotations(path)
+        new_text, new_ms = timed(organize_annotations, annotations, args.repeat)
+        legacy_text, legacy_ms = timed(organize_annotations_legacy, annotations, args.repeat)
+
+        new_words, legacy_words = new_text.split(), legacy_text.split()
+        missing = Counter(new_words) - Counter(legacy_words)
+        ratio = difflib.SequenceMatcher(None, legacy_words, new_words, autojunk=False).ratio()
+        print(f'{path}: {len(annotations) - 1} words, new {new_ms:.1f}ms, legacy {legacy_ms:.1f}ms, '
+              f'identical: {new_text == legacy_text}, order similarity: {ratio:.3f}, '
+              f'words dropped by legacy: {sum(missing.values())}')
+        if args.show_diff and new_text != legacy_text:
+            for line in difflib.unified_diff(legacy_words, new_words, 'legacy', 'new', lineterm='', n=2):
+                print('   ', line)
+
+
+if __name__ == '__main__':
+    main()
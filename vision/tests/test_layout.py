@@ -0,0 +1,57 @@
+# Run from the repository root: python -m pytest vision/tests
+import os
+import re
+from collections import Counter
+
+import pytest
+
+from vision.compare_layout import load_annotations
+from vision.vision_api import (
+    INBOUND_EMAIL_PATTERN,
+    INBOUND_PHONE_PATTERN,
+    organize_annotations,
+    organize_annotations_legacy,
+)
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+# Reading order of each recorded response
+EXPECTED_LAYOUTS = {
+    'hello_world': 'Hello World Next line',
+    'generic_inbound_form': 'STREET ADDRESS : 123 MAIN ST HOME # : 555-0100 EMAIL ADDRESS : jdoe@example.com CELL',
+    'med_card': "Medical Examiner's Certificate Expiration Date 04/15/2026",
+}
+
+
+def annotations(name):
+    return load_annotations(os.path.join(FIXTURES, f'{name}.json'))
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED_LAYOUTS))
+def test_layout_of_recorded_responses(name):
+    assert organize_annotations(annotations(name)) == EXPECTED_LAYOUTS[name]
+
+
+@pytest.mark.parametrize('name', sorted(EXPECTED_LAYOUTS))
+def test_layout_keeps_every_word_of_the_legacy_layout(name):
+    recorded = annotations(name)
+    new_words = Counter(organize_annotations(recorded).split())
+    legacy_words = Counter(organize_annotations_legacy(recorded).split())
+    assert not legacy_words - new_words
+
+
+def test_legacy_layout_dropped_the_first_word():
+    recorded = annotations('hello_world')
+    assert organize_annotations_legacy(recorded) == 'World Next line'
+    assert organize_annotations(recorded) == 'Hello World Next line'
+
+
+def test_onboarding_patterns_parse_the_layout():
+    text = organize_annotations(annotations('generic_inbound_form'))
+    assert re.search(INBOUND_PHONE_PATTERN, text).group(1) == '555-0100'
+    assert re.search(INBOUND_EMAIL_PATTERN, text).group(1) == 'jdoe@example.com'
+
+
+def test_column_gap_separates_label_from_value():
+    text = organize_annotations(annotations('generic_inbound_form'), column_gap=5, column_separator=' | ')
+    assert text == 'STREET ADDRESS : | 123 MAIN ST HOME # : | 555-0100 EMAIL ADDRESS : | jdoe@example.com CELL'
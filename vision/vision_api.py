@@ -1,16 +1,103 @@
+# Run from the repository root (python -m vision.vision_api), the OCR engines are shared with the order entry app
 import datetime
-import io
 import os
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pdfplumber
-from google.cloud import vision
-from pdf2image import convert_from_path
+
+from Mcleod_api.orders.utils.ocr_engines import build_ocr_engines
+from Mcleod_api.orders.utils.pdf_render import render_page_jpeg, render_settings_from_env
 
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = r'googlecreds.json'
 poppler_path = r'poppler-24.02.0\Library\bin'
 
-def organize_annotations(text_annotations):
+# Pages with less text than this in their text layer are OCRed
+MIN_TEXT_LAYER_CHARS = int(os.getenv('MIN_TEXT_LAYER_CHARS', '20'))
+# Scanned pages of a document OCRed at the same time
+OCR_WORKERS = int(os.getenv('VISION_OCR_WORKERS', '4'))
+
+# Fields parsed by extract_data_from_pdf, also used to decide when to escalate the OCR
+# Whitespace and the spacing around colons differ between the OCR text and the pdfplumber text layer
+MVR_DATES_PATTERN = r'Date Request Submitted\s*:\s*(\w{3} \d\d?, \d{4}) \d\d?:\d\d? \wM PDT\s+Request Completion Date\s*:\s*(\w{3} \d\d?, \d{4}) \d\d?:\d\d?'
+PHYSICAL_DUE_PATTERN = r"Medical Examiner's Certificate Expiration .*?\n\s*(\d\d?(?:-|\/)\d\d?(?:-|\/)\d{2,4})"
+INBOUND_ADDRESS_PATTERN = r'STREET ADDRESS\s*:\s*(.*?)STATE'
+INBOUND_EMAIL_PATTERN = r'EMAIL ADDRESS\s*:\s*(.*?) CELL'
+INBOUND_PHONE_PATTERN = r'HOME #\s*:\s*(.*?) '
+INBOUND_DOB_PATTERN = r'BIRTH .*?(\d\d-\d\d-\d{4})'
+GENERIC_INBOUND_PATTERNS = [INBOUND_ADDRESS_PATTERN, INBOUND_EMAIL_PATTERN, INBOUND_DOB_PATTERN]
+# The Per Diem opt-in is a checkbox: the OCR reads the tick as an X before the statement, the text layer has no tick at all
+PER_DIEM_STATEMENT_PATTERN = r'I would like to participate'
+PER_DIEM_OPT_IN_PATTERN = r'XI would like to participate'
+
+_ocr_engines = None
+_ocr_engines_lock = threading.Lock()
+
+
+def get_ocr_engines():
+    """OCR engines shared by every document of the process, built the first time a page needs OCR."""
+    global _ocr_engines
+    with _ocr_engines_lock:
+        if _ocr_engines is None:
+            _ocr_engines = build_ocr_engines()
+        return _ocr_engines
+
+
+def ocr_engine_stats():
+    """Latency and field completeness of each OCR engine used so far, like GrainVisionFallback.engine_stats."""
+    return {engine.name: engine.stats() for engine in _ocr_engines or []}
+
+
+def organize_annotations(text_annotations, line_tolerance=0.5, column_gap=None, column_separator=' '):
+    """
+    Concatenate the OCR words of a page in reading order.
+
+    The first annotation (the full text of the page) is skipped. Words are clustered into
+    lines by the vertical center of their boxes: a new line starts wherever the gap to
+    the previous center exceeds `line_tolerance` times the median word height. Each line
+    is sorted by x, and when `column_gap` is set, gaps wider than `column_gap` median
+    heights split it into columns joined with `column_separator`.
+
+    Args:
+        text_annotations (list): Vision text_annotations, or OcrResult annotations
+
+    Returns:
+        str: The words of the page joined by spaces, line by line
+    """
+    words = text_annotations[1:]
+    if not words:
+        return ''
+
+    # (n, 4, 2) array of the box vertices of every word
+    boxes = np.array([[(vertex.x, vertex.y) for vertex in word.bounding_poly.vertices] for word in words], dtype=float)
+    x_min = boxes[:, :, 0].min(axis=1)
+    x_max = boxes[:, :, 0].max(axis=1)
+    y_min = boxes[:, :, 1].min(axis=1)
+    y_max = boxes[:, :, 1].max(axis=1)
+    y_center = (y_min + y_max) / 2
+    median_height = max(np.median(y_max - y_min), 1.0)
+    tolerance = line_tolerance * median_height
+
+    by_center = np.argsort(y_center, kind='stable')
+    new_line = np.concatenate(([0], np.diff(y_center[by_center]) > tolerance))
+    line_ids = np.empty(len(words), dtype=int)
+    line_ids[by_center] = np.cumsum(new_line)
+
+    order = np.lexsort((x_min, line_ids))
+    separators = np.full(len(words), ' ', dtype=object)
+    if column_gap is not None and len(order) > 1:
+        same_line = line_ids[order[1:]] == line_ids[order[:-1]]
+        gaps = x_min[order[1:]] - x_max[order[:-1]]
+        separators[1:][same_line & (gaps > column_gap * median_height)] = column_separator
+
+    descriptions = [words[i].description for i in order]
+    return descriptions[0] + ''.join(separator + description for separator, description in zip(separators[1:], descriptions[1:]))
+
+
+def organize_annotations_legacy(text_annotations):
+    """Previous layout of organize_annotations, kept to compare outputs (see compare_layout.py)."""
 
     # Step 2: Create a dictionary to map each text annotation to its (x, y) coordinates
     text_dict = {}
@@ -60,31 +147,131 @@ def organize_annotations(text_annotations):
     concatenated_text = concatenated_text.strip()
     return concatenated_text
 
-# Create a function to extract all text from pdf using Google Vision API
-def extract_data_from_pdf(hire_info):
-    """Detects document features in an image."""
-    client = vision.ImageAnnotatorClient()
-    for file in hire_info['downloads']:
-        if file.endswith('.pdf'):
-            images = convert_from_path(file, poppler_path=poppler_path)
-            pdf_text = ''
-            for i, image in enumerate(images):
-                img_dir = file[:-4] + 'page' + str(i) + '.jpg'
-                image.save(img_dir, 'JPEG')
+def requires_ocr(file):
+    """Documents whose fields only show in the rendering of their pages, OCRed even when they have a text layer."""
+    return 'Per Diem Pay' in file
 
-                with io.open(img_dir, 'rb') as image_file:
-                    content = image_file.read()
 
-                image_file = vision.Image(content=content)
+def document_missing_fields(file):
+    """
+    Check of the fields extract_data_from_pdf parses from a document, used to decide whether
+    its scanned pages need a better OCR engine.
 
-                response = client.document_text_detection(image=image_file)
-                document = response.full_text_annotation
-                pdf_text += document.text
-                if response.text_annotations:
-                    concat_text = organize_annotations(response.text_annotations)
+    Returns:
+        callable: (pdf_text, concat_text) -> (missing, expected) field counts
+    """
+    patterns = []
+    if 'HireRightMVR' in file:
+        patterns.append((MVR_DATES_PATTERN, 'pdf_text'))
+    if any(x in file.lower() for x in ['Med Card','Medcard']):
+        patterns.append((PHYSICAL_DUE_PATTERN, 'pdf_text'))
+    if 'Generic Inbound' in file:
+        patterns += [(pattern, 'concat_text') for pattern in GENERIC_INBOUND_PATTERNS]
+    if requires_ocr(file):
+        # Escalate until the statement next to the checkbox is read
+        patterns.append((PER_DIEM_STATEMENT_PATTERN, 'pdf_text'))
+
+    def missing_fields(pdf_text, concat_text):
+        if not patterns:
+            # Nothing parsed with a pattern, only pages without any text are escalated
+            return (0 if pdf_text.strip() else 1), 1
+        texts = {'pdf_text': pdf_text, 'concat_text': concat_text}
+        return sum(not re.search(pattern, texts[source]) for pattern, source in patterns), len(patterns)
+
+    return missing_fields
+
+
+def read_pdf_pages(file, with_tables=False, missing_fields=None):
+    """
+    Read the text of every page of a PDF, from its text layer when it has one.
+
+    Pages whose text layer has fewer than MIN_TEXT_LAYER_CHARS characters are treated as
+    scanned: they are rendered in memory once and OCRed concurrently, with the cheapest
+    engine first. The whole document moves on to the next engine while `missing_fields`
+    reports fields its text is still missing.
+
+    Every page is OCRed for the documents of requires_ocr, and for documents whose text
+    layer covers every page but still misses fields.
+
+    Args:
+        file (str): PDF file
+        with_tables (bool): Also extract the first table of each page from the text layer
+        missing_fields (callable): (pdf_text, concat_text) -> (missing, expected), document_missing_fields(file) by default
+
+    Returns:
+        tuple: (text of every page joined, words of every page in reading order, table of each page)
+    """
+    missing_fields = missing_fields or document_missing_fields(file)
+    layer_texts = []
+    tables = []
+    with pdfplumber.open(file) as pdf:
+        for page in pdf.pages:
+            layer_texts.append(page.extract_text() or '')
+            tables.append(page.extract_table() if with_tables else None)
+
+    page_texts = list(layer_texts)
+    page_words = [' '.join(text.split()) for text in layer_texts]
+    scanned = [i for i, text in enumerate(layer_texts) if len(text.strip()) < MIN_TEXT_LAYER_CHARS]
+    if requires_ocr(file):
+        scanned = list(range(len(layer_texts)))
+    best = None
+    if not scanned:
+        pdf_text = '\n'.join(page_texts)
+        concat_text = ' '.join(words for words in page_words if words)
+        missing, expected = missing_fields(pdf_text, concat_text)
+        if not missing or not layer_texts:
+            return pdf_text, concat_text, tables
+        # The layer does not parse, e.g. a different layout than the OCR text: OCR every page instead
+        print(f'Text layer of {file} misses {missing} of {expected} fields, OCRing every page')
+        scanned = list(range(len(layer_texts)))
+        best = (missing, pdf_text, concat_text)
+
+    settings = render_settings_from_env()
+
+    def render_page(i):
+        return render_page_jpeg(file, settings, page_number=i + 1, poppler_path=poppler_path)
+
+    def ocr_page(engine, content):
+        if content is None:
+            return None
+        try:
+            return engine.detect(content)
+        except Exception as e:
+            print(f'{engine.name} OCR error on {file}: {e}')
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(OCR_WORKERS, len(scanned))) as executor:
+        images = list(executor.map(render_page, scanned))
+        for engine in get_ocr_engines():
+            results = executor.map(lambda content: ocr_page(engine, content), images)
+            for i, result in zip(scanned, results):
+                # Pages the engine failed on keep the text of the previous one
+                if result is not None:
+                    page_texts[i] = result.text
+                    page_words[i] = organize_annotations(result.annotations) if result.annotations else ''
+
+            pdf_text = '\n'.join(page_texts)
+            concat_text = ' '.join(words for words in page_words if words)
+            missing, expected = missing_fields(pdf_text, concat_text)
+            engine.record_accuracy(expected - missing, expected)
+            if best is None or missing < best[0]:
+                best = (missing, pdf_text, concat_text)
+            if not missing:
+                break
+            print(f'{engine.name} missed {missing} of {expected} fields of {file}, escalating')
+    print(f'OCRed {len(scanned)} of {len(layer_texts)} pages of {file}')
+
+    return best[1], best[2], tables
+
+
+def extract_data_from_pdf(hire_info):
+    """Reads the downloaded onboarding documents, OCRing only the scanned pages."""
+    for file in hire_info['downloads']:
+        if file.endswith('.pdf'):
+            pdf_text, concat_text, tables = read_pdf_pages(file, with_tables='Generic Inbound' in file)
 
         if 'HireRightMVR' in file:
-            MVRdate = re.search('Date Request Submitted: (\w{3} \d\d?, \d{4}) \d\d?:\d\d? \wM PDT\\nRequest Completion Date: (\w{3} \d\d?, \d{4}) \d\d?:\d\d?', pdf_text)
+            MVRdate = re.search(MVR_DATES_PATTERN, pdf_text)
             if MVRdate:
                 if 'MVR' not in hire_info.keys() and MVRdate:
                     hire_info['MVR'] = (datetime.datetime.strptime(MVRdate.group(1), '%b %d, %Y')).strftime('%m-%d-%Y')
@@ -96,34 +283,32 @@ def extract_data_from_pdf(hire_info):
                 print('could not pick up mvr data for candidate')
 
         if any(x in file.lower() for x in ['Med Card','Medcard']):
-            physical_due = re.search("Medical Examiner\'s Certificate Expiration .*?\n(\d\d?(?:-|\/)\d\d?(?:-|\/)\d{2,4})", pdf_text)
+            physical_due = re.search(PHYSICAL_DUE_PATTERN, pdf_text)
             if physical_due:
                 hire_info['physical_due'] = physical_due.group(1)
             else:
                 print('could not pick up med card data for candidate')
 
         if 'Generic Inbound' in file:
-            full_text = ''
-            with pdfplumber.open(file) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    table = page.extract_table()
-                    full_text += text
-            table.pop(0)
-            full_text = full_text.replace('\n', '')
+            # Text layer and tables were already read with the rest of the document
+            full_text = pdf_text.replace('\n', '')
+            table = tables[-1] if tables else None
             try:
-                hire_info['Address'] = re.search('STREET ADDRESS : (.*?)STATE', concat_text).group(1)
-                hire_info['phone'] = re.search('HOME # : (.*?) ', concat_text).group(1) if re.search('HOME # : (.*?) ', concat_text) else re.search('HOME # : (.*?) ', full_text)
-                hire_info['email'] = re.search('EMAIL ADDRESS : (.*?) CELL', concat_text).group(1)
-                hire_info['dob'] = re.search('BIRTH .*?(\d\d-\d\d-\d{4})', concat_text).group(1)
+                table.pop(0)
+                hire_info['Address'] = re.search(INBOUND_ADDRESS_PATTERN, concat_text).group(1)
+                hire_info['phone'] = re.search(INBOUND_PHONE_PATTERN, concat_text).group(1) if re.search(INBOUND_PHONE_PATTERN, concat_text) else re.search(INBOUND_PHONE_PATTERN, full_text)
+                hire_info['email'] = re.search(INBOUND_EMAIL_PATTERN, concat_text).group(1)
+                hire_info['dob'] = re.search(INBOUND_DOB_PATTERN, concat_text).group(1)
                 hire_info['contacts'] = [[item[0],item[3], item[6]] for item in table]
             except:
                 print('could not parse the generic inbound pdf.')
                 print(full_text)
 
         if 'Per Diem Pay' in file:
-            hire_info['Perdiem'] = True if re.search('XI would like to participate', pdf_text) else False
+            hire_info['Perdiem'] = True if re.search(PER_DIEM_OPT_IN_PATTERN, pdf_text) else False
 
+    if _ocr_engines is not None:
+        print('OCR engines:', ocr_engine_stats())
 
     return hire_info
 